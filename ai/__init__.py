@@ -3,24 +3,26 @@ AI module for PocketVibe
 Provides interfaces and implementations for various AI providers
 """
 
+import functools
+import importlib
+
 from .base import AIProvider
 
-# Use lazy imports to avoid circular dependencies
+# Provider name -> (module path, class name), imported lazily to avoid circular dependencies
+_PROVIDER_PATHS = {
+    "openai": ("ai.providers.openai_provider", "OpenAIProvider"),
+    "anthropic": ("ai.providers.anthropic_provider", "AnthropicProvider"),
+    "openrouter": ("ai.providers.openrouter_provider", "OpenRouterProvider"),
+    "stability": ("ai.providers.stability_provider", "StabilityAIProvider"),
+}
+
+@functools.lru_cache(maxsize=None)
 def get_provider(provider_name: str):
     """Lazy import of provider classes"""
-    if provider_name.lower() == "openai":
-        from .providers.openai_provider import OpenAIProvider
-        return OpenAIProvider
-    elif provider_name.lower() == "anthropic":
-        from .providers.anthropic_provider import AnthropicProvider
-        return AnthropicProvider
-    elif provider_name.lower() == "openrouter":
-        from .providers.openrouter_provider import OpenRouterProvider
-        return OpenRouterProvider
-    elif provider_name.lower() == "stability":
-        from .providers.stability_provider import StabilityAIProvider
-        return StabilityAIProvider
-    else:
+    try:
+        mod_path, cls_name = _PROVIDER_PATHS[provider_name.lower()]
+    except KeyError:
         raise ValueError(f"Unknown provider: {provider_name}")
+    return getattr(importlib.import_module(mod_path), cls_name)
 
-__all__ = ['AIProvider', 'get_provider'] 
\ No newline at end of file
+__all__ = ['AIProvider', 'get_provider'] 
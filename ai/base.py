@@ -1,8 +1,13 @@
 """
 Base interface for AI providers
 """
+import asyncio
+import logging
+import weakref
 from abc import ABC, abstractmethod
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterator
+
+logger = logging.getLogger(__name__)
 
 class AIProvider(ABC):
     """Base class for AI providers"""
@@ -21,6 +26,111 @@ class AIProvider(ABC):
         """
         pass
     
+    def generate_content_cached(self, prompt: str, cache_key: Optional[str] = None, **kwargs) -> str:
+        """
+        Generate content, serving near-duplicate requests from the semantic cache
+        
+        Args:
+            prompt: The input prompt
+            cache_key: Text to match on (defaults to the prompt); pass just the
+                user-supplied part when prompts share a long template
+            **kwargs: Additional provider-specific parameters
+            
+        Returns:
+            Generated content as string
+        """
+        from .cache import semantic_cache
+        if not semantic_cache.enabled:
+            return self.generate_content(prompt, **kwargs)
+        
+        namespace = f"{self.get_provider_name()}:{sorted(kwargs.items())}"
+        text = cache_key if cache_key is not None else prompt
+        embedding = None
+        try:
+            cached, embedding = semantic_cache.get(namespace, text)
+            if cached is not None:
+                return cached
+        except Exception as e:
+            logger.warning(f"Semantic cache lookup failed: {str(e)}")
+        
+        result = self.generate_content(prompt, **kwargs)
+        try:
+            semantic_cache.put(namespace, text, result, embedding)
+        except Exception as e:
+            logger.warning(f"Semantic cache insert failed: {str(e)}")
+        return result
+    
+    def stream_content(self, prompt: str, **kwargs) -> Iterator[str]:
+        """
+        Stream generated content as it is produced
+        
+        Providers with streaming support override this; the default yields
+        the full completion as a single chunk.
+        
+        Args:
+            prompt: The input prompt
+            **kwargs: Additional provider-specific parameters
+            
+        Returns:
+            Iterator over text chunks
+        """
+        yield self.generate_content(prompt, **kwargs)
+    
+    async def agenerate_content(self, prompt: str, **kwargs) -> str:
+        """
+        Asynchronously generate content based on the prompt
+        
+        Providers with a native async client override this; the default
+        runs the blocking call in a worker thread.
+        
+        Args:
+            prompt: The input prompt
+            **kwargs: Additional provider-specific parameters
+            
+        Returns:
+            Generated content as string
+        """
+        return await asyncio.to_thread(self.generate_content, prompt, **kwargs)
+    
+    def batch_generate_content(self, prompts: list[str], concurrency: int = 10, **kwargs) -> list[str]:
+        """
+        Generate content for several prompts concurrently
+        
+        Args:
+            prompts: The input prompts
+            concurrency: Maximum number of in-flight requests
+            **kwargs: Additional provider-specific parameters
+            
+        Returns:
+            Generated content for each prompt, in the same order
+        """
+        return asyncio.run(self._batch(prompts, concurrency, **kwargs))
+    
+    async def _batch(self, prompts: list[str], concurrency: int = 10, **kwargs) -> list[str]:
+        """Fan prompts out to agenerate_content with bounded concurrency"""
+        sem = asyncio.Semaphore(concurrency)
+        
+        async def bounded(prompt):
+            async with sem:
+                return await self.agenerate_content(prompt, **kwargs)
+        
+        return await asyncio.gather(*[bounded(p) for p in prompts])
+    
+    def _get_async_client(self, factory):
+        """
+        Get the async client bound to the running event loop
+        
+        Async HTTP clients can't be shared across event loops, so one is built
+        with factory() per loop (e.g. per asyncio.run, or per thread when the
+        provider instance is shared).
+        """
+        loop = asyncio.get_running_loop()
+        clients = self.__dict__.setdefault('_async_clients', weakref.WeakKeyDictionary())
+        client = clients.get(loop)
+        if client is None:
+            client = clients[loop] = factory()
+        return client
+    
     @abstractmethod
     def generate_image(self, prompt: str, **kwargs) -> str:
         """
@@ -35,6 +145,19 @@ class AIProvider(ABC):
         """
         pass
     
+    async def agenerate_image(self, prompt: str, **kwargs) -> str:
+        """
+        Asynchronously generate an image based on the prompt
+        
+        Args:
+            prompt: The input prompt
+            **kwargs: Additional provider-specific parameters
+            
+        Returns:
+            URL or path to the generated image
+        """
+        return await asyncio.to_thread(self.generate_image, prompt, **kwargs)
+    
     @classmethod
     @abstractmethod
     def get_provider_name(cls) -> str:
@@ -43,6 +166,6 @@ class AIProvider(ABC):
     
     @classmethod
     @abstractmethod
-    def get_required_env_vars(cls) -> list[str]:
+    def get_required_env_vars(cls) -> tuple[str, ...]:
         """Get list of required environment variables"""
         pass 
\ No newline at end of file
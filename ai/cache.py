@@ -0,0 +1,85 @@
+"""
+In-process semantic cache for AI responses
+
+Prompts are matched first by exact hash, then by cosine similarity of their
+embeddings against the most recent entries. Enabled with AI_SEMANTIC_CACHE=1.
+"""
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+class SemanticCache:
+    """Bounded FIFO of (embedding, response) pairs with an exact-match fast path"""
+
+    def __init__(self, maxsize: int = 1000, threshold: float = 0.95):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.enabled = os.getenv("AI_SEMANTIC_CACHE") == "1"
+        self._exact = OrderedDict()
+        self._entries = deque(maxlen=maxsize)
+        self._lock = threading.Lock()
+        self._client = None
+
+    def embed(self, text: str) -> np.ndarray:
+        """Embed text and return a unit-length vector"""
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(api_key=os.getenv("chatgptapikey"), max_retries=3)
+        response = self._client.embeddings.create(model=EMBEDDING_MODEL, input=text)
+        vec = np.asarray(response.data[0].embedding, dtype=np.float32)
+        return vec / np.linalg.norm(vec)
+
+    @staticmethod
+    def _hash(namespace: str, text: str) -> str:
+        return hashlib.sha256(f"{namespace}\0{text}".encode('utf-8')).hexdigest()
+
+    def get(self, namespace: str, text: str) -> tuple[Optional[str], Optional[np.ndarray]]:
+        """
+        Look up a cached response
+
+        Args:
+            namespace: Separates entries by provider/parameters
+            text: The text to match on
+
+        Returns:
+            (response, embedding) - response is None on a miss; the embedding
+            is returned so the caller can pass it back to put()
+        """
+        key = self._hash(namespace, text)
+        with self._lock:
+            if key in self._exact:
+                self._exact.move_to_end(key)
+                return self._exact[key], None
+            entries = [(vec, response) for ns, vec, response in self._entries if ns == namespace]
+
+        query = self.embed(text)
+        if entries:
+            scores = np.stack([vec for vec, _ in entries]) @ query
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                logger.info(f"[Cache] Semantic hit (similarity {scores[best]:.3f})")
+                return entries[best][1], query
+        return None, query
+
+    def put(self, namespace: str, text: str, response: str, embedding: Optional[np.ndarray] = None):
+        """Store a response for later lookups"""
+        if embedding is None:
+            embedding = self.embed(text)
+        key = self._hash(namespace, text)
+        with self._lock:
+            self._exact[key] = response
+            self._exact.move_to_end(key)
+            while len(self._exact) > self.maxsize:
+                self._exact.popitem(last=False)
+            self._entries.append((namespace, embedding, response))
+
+semantic_cache = SemanticCache()
@@ -2,13 +2,22 @@
 Factory for creating AI provider instances
 """
 import os
+import time
+import asyncio
+import functools
 import logging
-from typing import Dict, Type
+from collections import deque
+from typing import Callable, Optional, Type
 from .base import AIProvider
-from . import get_provider
+from . import get_provider, _PROVIDER_PATHS
 
 logger = logging.getLogger(__name__)
 
+@functools.lru_cache(maxsize=None)
+def _missing_env_vars(provider_class: Type[AIProvider]) -> tuple[str, ...]:
+    """Required env vars that are unset for a provider class (computed once per process)"""
+    return tuple(var for var in provider_class.get_required_env_vars() if not os.getenv(var))
+
 class AIProviderFactory:
     """Factory for creating AI provider instances"""
     
@@ -27,20 +36,95 @@ class AIProviderFactory:
             ValueError: If provider not found or required env vars missing
         """
         try:
-            provider_class = get_provider(provider_name)
-            
-            # Check required environment variables
-            required_vars = provider_class.get_required_env_vars()
-            missing_vars = [var for var in required_vars if not os.getenv(var)]
-            if missing_vars:
-                raise ValueError(f"Missing required environment variables for {provider_name}: {', '.join(missing_vars)}")
-                
-            return provider_class()
+            # One instance (and HTTP connection pool) per provider per process
+            return cls._cached_provider(provider_name, os.getpid())
             
         except Exception as e:
             raise ValueError(f"Failed to get provider '{provider_name}': {str(e)}")
     
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def _cached_provider(cls, provider_name: str, pid: int) -> AIProvider:
+        """Build a provider instance; keyed on pid so forked workers don't share clients"""
+        provider_class = get_provider(provider_name)
+        
+        # Check required environment variables
+        missing_vars = _missing_env_vars(provider_class)
+        if missing_vars:
+            raise ValueError(f"Missing required environment variables for {provider_name}: {', '.join(missing_vars)}")
+            
+        return provider_class()
+    
     @classmethod
     def get_available_providers(cls) -> list[str]:
         """Get list of available provider names"""
-        return ["openai", "anthropic", "openrouter", "stability"] 
\ No newline at end of file
+        return list(_PROVIDER_PATHS)
+
+
+class _RateLimiter:
+    """Async limiter allowing at most `rate` acquisitions per `period` seconds"""
+    
+    def __init__(self, rate: int, period: float = 60.0):
+        self.rate = rate
+        self.period = period
+        self._calls = deque()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._calls and now - self._calls[0] >= self.period:
+                    self._calls.popleft()
+                if len(self._calls) < self.rate:
+                    self._calls.append(now)
+                    return
+                await asyncio.sleep(self.period - (now - self._calls[0]))
+
+
+async def run_batch(tasks: list[tuple], max_concurrency: int = 10, rpm: int = 100,
+                    on_progress: Optional[Callable[[int, int], None]] = None) -> list:
+    """
+    Run a mixed batch of provider calls concurrently
+    
+    Args:
+        tasks: (provider, prompt) or (provider, prompt, kind) tuples, where provider is an
+            AIProvider or provider name and kind is "content" (default) or "image"
+        max_concurrency: Maximum number of in-flight requests
+        rpm: Maximum number of requests started per minute
+        on_progress: Optional callback invoked with (completed, total) after each task
+        
+    Returns:
+        Results in the same order as tasks
+    """
+    sem = asyncio.Semaphore(max_concurrency)
+    limiter = _RateLimiter(rpm, 60)
+    total = len(tasks)
+    completed = 0
+    
+    async def run(task):
+        nonlocal completed
+        provider, prompt, *rest = task
+        kind = rest[0] if rest else "content"
+        if isinstance(provider, str):
+            provider = AIProviderFactory.get_provider(provider)
+        
+        async with sem:
+            await limiter.acquire()
+            if kind == "image":
+                result = await provider.agenerate_image(prompt)
+            else:
+                result = await provider.agenerate_content(prompt)
+        
+        completed += 1
+        if on_progress:
+            on_progress(completed, total)
+        return result
+    
+    return await asyncio.gather(*[run(task) for task in tasks])
+
+
+def run_batch_sync(tasks: list[tuple], max_concurrency: int = 10, rpm: int = 100,
+                   on_progress: Optional[Callable[[int, int], None]] = None) -> list:
+    """Blocking wrapper around run_batch"""
+    return asyncio.run(run_batch(tasks, max_concurrency, rpm, on_progress))
@@ -2,13 +2,38 @@
 Anthropic (Claude) provider implementation
 """
 import os
+import time
 import logging
-from typing import Optional
+from typing import Optional, Iterator
 from ..base import AIProvider
-import anthropic
 
 logger = logging.getLogger(__name__)
 
+REQUIRED_ENV_VARS = ("ANTHROPIC_API_KEY",)
+
+# Website generator instructions, sent as a cacheable system prompt
+SITE_SYSTEM_PROMPT = """
+    You are an expert website generator. 
+    Only reply with complete website code based on user descriptions. 
+    Do not explain anything. 
+    Create a complete, valid HTML document with embedded CSS and JavaScript based on the user's description. 
+    Prioritize CSS-based visuals for modern design:
+    - Use CSS gradients, shapes, and patterns for visual interest
+    - Create abstract geometric backgrounds and card layouts with CSS
+    - Build hero sections and visual hierarchy using CSS styling
+    - Only use photos when specifically needed for content (portfolio, gallery, product images)
+    For images when necessary, use https://picsum.photos/seed/KEYWORD/WIDTH/HEIGHT with relevant keywords.
+    For icons and simple graphics, use embedded base64 SVG data or Unicode symbols.
+    Follow mobile-first responsive design with proper breakpoints:
+    - Design for mobile (320px+) first 
+    - Add tablet styles using @media (min-width: 768px)
+    - Add desktop styles using @media (min-width: 1024px)
+    - Use relative units (rem, em, %, vw, vh) and fluid layouts
+    - Ensure content scales smoothly between breakpoints
+    Use modern CSS features (flexbox, grid, custom properties) with cross-browser compatibility.
+    Make layouts flexible and adaptive across all screen sizes while prioritizing mobile experience.
+    """
+
 class AnthropicProvider(AIProvider):
     """Anthropic implementation of AIProvider"""
     
@@ -16,8 +41,11 @@ class AnthropicProvider(AIProvider):
         api_key = os.getenv("ANTHROPIC_API_KEY")
         if not api_key:
             raise ValueError("Anthropic API key not found")
-        # Initialize Anthropic client here when implemented
-        # self.client = Anthropic(api_key=api_key)
+        self.api_key = api_key
+        # Imported here so the SDK is only loaded when this provider is used
+        import anthropic
+        # Reuse one client (and its connection pool) across calls
+        self.client = anthropic.Anthropic(api_key=self.api_key, max_retries=3)
     
     def generate_content(self, prompt: str, **kwargs) -> str:
         """
@@ -25,18 +53,16 @@ class AnthropicProvider(AIProvider):
         
         Args:
             prompt: The input prompt
+            **kwargs: Additional parameters (system)
             
         Returns:
             Generated content as string
         """
         try:
-            client = anthropic.Anthropic(
-                # defaults to os.environ.get("ANTHROPIC_API_KEY")
-                api_key=os.getenv("ANTHROPIC_API_KEY"),
-            )
-            message = client.messages.create(
+            message = self.client.messages.create(
                 model="claude-opus-4-20250514",
                 max_tokens=10240,
+                **self._system_param(kwargs.get('system')),
                 messages=[
                     {
                         "role": "user",
@@ -51,6 +77,148 @@ class AnthropicProvider(AIProvider):
             logger.error(f"Anthropic content generation failed: {str(e)}")
             raise
     
+    def stream_content(self, prompt: str, **kwargs) -> Iterator[str]:
+        """
+        Stream content from Anthropic's API as it is generated
+        
+        Args:
+            prompt: The input prompt
+            **kwargs: Additional parameters (system)
+            
+        Returns:
+            Iterator over text chunks
+        """
+        try:
+            with self.client.messages.stream(
+                model="claude-opus-4-20250514",
+                max_tokens=10240,
+                **self._system_param(kwargs.get('system')),
+                messages=[
+                    {
+                        "role": "user",
+                        "content": prompt
+                    }
+                ]
+            ) as stream:
+                for text in stream.text_stream:
+                    yield text
+        except Exception as e:
+            logger.error(f"Anthropic content streaming failed: {str(e)}")
+            raise
+    
+    async def agenerate_content(self, prompt: str, **kwargs) -> str:
+        """
+        Asynchronously generate content using Anthropic's API
+        
+        Args:
+            prompt: The input prompt
+            **kwargs: Additional parameters (system)
+            
+        Returns:
+            Generated content as string
+        """
+        try:
+            import anthropic
+            client = self._get_async_client(lambda: anthropic.AsyncAnthropic(api_key=self.api_key, max_retries=3))
+            message = await client.messages.create(
+                model="claude-opus-4-20250514",
+                max_tokens=10240,
+                **self._system_param(kwargs.get('system')),
+                messages=[
+                    {
+                        "role": "user",
+                        "content": prompt
+                    }
+                ]
+            )
+
+            logger.info(f"API Response: {message}")
+            return message.content[0].text
+        except Exception as e:
+            logger.error(f"Anthropic async content generation failed: {str(e)}")
+            raise
+    
+    @staticmethod
+    def _system_param(system: Optional[str]) -> dict:
+        """Build the system= argument, marking it for Anthropic prompt caching"""
+        if not system:
+            return {}
+        return {
+            "system": [
+                {
+                    "type": "text",
+                    "text": system,
+                    "cache_control": {"type": "ephemeral"}
+                }
+            ]
+        }
+    
+    def submit_batch(self, prompts: list[str]) -> str:
+        """
+        Submit prompts to Anthropic's Message Batches API (half the cost of synchronous calls)
+        
+        Args:
+            prompts: The input prompts; each result is keyed by its index as a string
+            
+        Returns:
+            ID of the created batch
+        """
+        try:
+            batch = self.client.messages.batches.create(
+                requests=[
+                    {
+                        "custom_id": str(i),
+                        "params": {
+                            "model": "claude-opus-4-20250514",
+                            "max_tokens": 10240,
+                            "messages": [
+                                {
+                                    "role": "user",
+                                    "content": prompt
+                                }
+                            ]
+                        }
+                    }
+                    for i, prompt in enumerate(prompts)
+                ]
+            )
+
+            logger.info(f"Anthropic batch {batch.id} submitted with {len(prompts)} requests")
+            return batch.id
+        except Exception as e:
+            logger.error(f"Anthropic batch submission failed: {str(e)}")
+            raise
+    
+    def wait_for_batch(self, batch_id: str, poll_interval: int = 30) -> dict[str, Optional[str]]:
+        """
+        Block until a batch finishes and collect its results
+        
+        Args:
+            batch_id: ID returned by submit_batch
+            poll_interval: Seconds between status checks
+            
+        Returns:
+            Mapping of custom_id to generated text (None for failed requests)
+        """
+        try:
+            batch = self.client.messages.batches.retrieve(batch_id)
+            while batch.processing_status != "ended":
+                time.sleep(poll_interval)
+                batch = self.client.messages.batches.retrieve(batch_id)
+
+            results = {}
+            for entry in self.client.messages.batches.results(batch_id):
+                if entry.result.type == "succeeded":
+                    results[entry.custom_id] = entry.result.message.content[0].text
+                else:
+                    logger.warning(f"Anthropic batch {batch_id} request {entry.custom_id} {entry.result.type}")
+                    results[entry.custom_id] = None
+
+            return results
+        except Exception as e:
+            logger.error(f"Anthropic batch retrieval failed: {str(e)}")
+            raise
+    
     def generate_image(self, prompt: str, **kwargs) -> str:
         """
         Generate an image using Anthropic's API
@@ -70,34 +238,13 @@ class AnthropicProvider(AIProvider):
         return "anthropic"
     
     @classmethod
-    def get_required_env_vars(cls) -> list[str]:
-        return ["ANTHROPIC_API_KEY"]
+    def get_required_env_vars(cls) -> tuple[str, ...]:
+        return REQUIRED_ENV_VARS
     
 if __name__ == "__main__":
     prompt = "build a website for a small business that sells handmade jewelry"
-    full_prompt = """
-    You are an expert website generator. 
-    Only reply with complete website code based on user descriptions. 
-    Do not explain anything. 
-    Create a complete, valid HTML document with embedded CSS and JavaScript based on the user's description. 
-    Prioritize CSS-based visuals for modern design:
-    - Use CSS gradients, shapes, and patterns for visual interest
-    - Create abstract geometric backgrounds and card layouts with CSS
-    - Build hero sections and visual hierarchy using CSS styling
-    - Only use photos when specifically needed for content (portfolio, gallery, product images)
-    For images when necessary, use https://picsum.photos/seed/KEYWORD/WIDTH/HEIGHT with relevant keywords.
-    For icons and simple graphics, use embedded base64 SVG data or Unicode symbols.
-    Follow mobile-first responsive design with proper breakpoints:
-    - Design for mobile (320px+) first 
-    - Add tablet styles using @media (min-width: 768px)
-    - Add desktop styles using @media (min-width: 1024px)
-    - Use relative units (rem, em, %, vw, vh) and fluid layouts
-    - Ensure content scales smoothly between breakpoints
-    Use modern CSS features (flexbox, grid, custom properties) with cross-browser compatibility.
-    Make layouts flexible and adaptive across all screen sizes while prioritizing mobile experience.
-    Here is the user's description: """ + prompt
     provider = AnthropicProvider()
-    result = provider.generate_content(full_prompt)
+    result = provider.generate_content(f"Here is the user's description: {prompt}", system=SITE_SYSTEM_PROMPT)
     # Write result to file
     with open('anthropic_response.txt', 'w', encoding='utf-8') as f:
         f.write(result)
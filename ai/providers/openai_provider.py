@@ -2,13 +2,17 @@
 OpenAI provider implementation
 """
 import os
+import io
+import json
+import time
 import logging
-from typing import Optional
-from openai import OpenAI
+from typing import Optional, Iterator
 from ..base import AIProvider
 
 logger = logging.getLogger(__name__)
 
+REQUIRED_ENV_VARS = ("chatgptapikey",)
+
 class OpenAIProvider(AIProvider):
     """OpenAI implementation of AIProvider"""
     
@@ -16,7 +20,9 @@ class OpenAIProvider(AIProvider):
         api_key = os.getenv("chatgptapikey")
         if not api_key:
             raise ValueError("OpenAI API key not found")
-        self.client = OpenAI(api_key=api_key)
+        # Imported here so the SDK is only loaded when this provider is used
+        from openai import OpenAI
+        self.client = OpenAI(api_key=api_key, max_retries=3)
     
     def generate_content(self, prompt: str, **kwargs) -> str:
         """
@@ -36,15 +42,148 @@ class OpenAIProvider(AIProvider):
                 input=prompt
             )
             
-            if not response or not response.output or not response.output[0].content:
-                raise Exception("Invalid response format from OpenAI API")
-                
-            return response.output[0].content[0].text
+            return self._extract_text(response)
             
         except Exception as e:
             logger.error(f"OpenAI content generation failed: {str(e)}")
             raise
     
+    def stream_content(self, prompt: str, **kwargs) -> Iterator[str]:
+        """
+        Stream content from OpenAI's API as it is generated
+        
+        Args:
+            prompt: The input prompt
+            **kwargs: Additional parameters (model, temperature, etc.)
+            
+        Returns:
+            Iterator over text chunks
+        """
+        try:
+            model = kwargs.get('model', 'gpt-4.1')
+            with self.client.responses.stream(
+                model=model,
+                input=prompt
+            ) as stream:
+                for event in stream:
+                    if event.type == "response.output_text.delta":
+                        yield event.delta
+                        
+        except Exception as e:
+            logger.error(f"OpenAI content streaming failed: {str(e)}")
+            raise
+    
+    async def agenerate_content(self, prompt: str, **kwargs) -> str:
+        """
+        Asynchronously generate content using OpenAI's API
+        
+        Args:
+            prompt: The input prompt
+            **kwargs: Additional parameters (model, temperature, etc.)
+            
+        Returns:
+            Generated content as string
+        """
+        try:
+            from openai import AsyncOpenAI
+            model = kwargs.get('model', 'gpt-4.1')
+            client = self._get_async_client(lambda: AsyncOpenAI(api_key=self.client.api_key, max_retries=3))
+            response = await client.responses.create(
+                model=model,
+                input=prompt
+            )
+            
+            return self._extract_text(response)
+            
+        except Exception as e:
+            logger.error(f"OpenAI async content generation failed: {str(e)}")
+            raise
+    
+    @staticmethod
+    def _extract_text(response) -> str:
+        """Pull the generated text out of a Responses API result"""
+        if not response or not response.output or not response.output[0].content:
+            raise Exception("Invalid response format from OpenAI API")
+            
+        return response.output[0].content[0].text
+    
+    def submit_batch(self, prompts: list[str], model: str = 'gpt-4.1') -> str:
+        """
+        Submit prompts to OpenAI's Batch API (half the cost of synchronous calls)
+        
+        Args:
+            prompts: The input prompts; each result is keyed by its index as a string
+            model: Model used for every request in the batch
+            
+        Returns:
+            ID of the created batch
+        """
+        try:
+            lines = [
+                json.dumps({
+                    "custom_id": str(i),
+                    "method": "POST",
+                    "url": "/v1/responses",
+                    "body": {"model": model, "input": prompt}
+                })
+                for i, prompt in enumerate(prompts)
+            ]
+            buf = io.BytesIO("\n".join(lines).encode('utf-8'))
+            buf.name = "batch.jsonl"
+            
+            batch_file = self.client.files.create(file=buf, purpose="batch")
+            batch = self.client.batches.create(
+                input_file_id=batch_file.id,
+                endpoint="/v1/responses",
+                completion_window="24h"
+            )
+            
+            logger.info(f"OpenAI batch {batch.id} submitted with {len(prompts)} requests")
+            return batch.id
+            
+        except Exception as e:
+            logger.error(f"OpenAI batch submission failed: {str(e)}")
+            raise
+    
+    def wait_for_batch(self, batch_id: str, poll_interval: int = 30) -> dict[str, Optional[str]]:
+        """
+        Block until a batch finishes and collect its results
+        
+        Args:
+            batch_id: ID returned by submit_batch
+            poll_interval: Seconds between status checks
+            
+        Returns:
+            Mapping of custom_id to generated text (None for failed requests)
+        """
+        try:
+            batch = self.client.batches.retrieve(batch_id)
+            while batch.status not in ("completed", "failed", "expired", "cancelled"):
+                time.sleep(poll_interval)
+                batch = self.client.batches.retrieve(batch_id)
+            
+            if batch.status != "completed" or not batch.output_file_id:
+                raise Exception(f"OpenAI batch {batch_id} ended with status: {batch.status}")
+            
+            results = {}
+            for line in self.client.files.content(batch.output_file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                response = item.get("response") or {}
+                body = response.get("body") or {}
+                try:
+                    results[item["custom_id"]] = body["output"][0]["content"][0]["text"]
+                except (KeyError, IndexError, TypeError):
+                    logger.warning(f"OpenAI batch {batch_id} request {item.get('custom_id')} failed: {item.get('error') or body}")
+                    results[item["custom_id"]] = None
+            
+            return results
+            
+        except Exception as e:
+            logger.error(f"OpenAI batch retrieval failed: {str(e)}")
+            raise
+    
     def generate_image(self, prompt: str, **kwargs) -> str:
         """
         Generate an image using DALL-E
@@ -81,8 +220,8 @@ class OpenAIProvider(AIProvider):
         return "openai"
     
     @classmethod
-    def get_required_env_vars(cls) -> list[str]:
-        return ["chatgptapikey"] 
+    def get_required_env_vars(cls) -> tuple[str, ...]:
+        return REQUIRED_ENV_VARS
     
 if __name__ == "__main__":
     provider = OpenAIProvider()
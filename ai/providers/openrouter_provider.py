@@ -3,13 +3,16 @@ OpenRouter provider implementation
 """
 import os
 import logging
-import requests
-import json
-from typing import Optional
+import httpx
+import orjson
+from typing import Optional, Iterator
 from ..base import AIProvider
+from ..retry import retry_transient
 
 logger = logging.getLogger(__name__)
 
+REQUIRED_ENV_VARS = ("openrouterapikey",)
+
 class OpenRouterProvider(AIProvider):
     """OpenRouter implementation of AIProvider"""
     
@@ -19,6 +22,25 @@ class OpenRouterProvider(AIProvider):
             raise ValueError("OpenRouter API key not found")
         self.api_key = api_key
         self.base_url = "https://openrouter.ai/api/v1"
+
+        self.headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "HTTP-Referer": "https://www.pocketvibe.app/",
+            "X-Title": "Pocket Vibe"
+        }
+        # Room for every concurrent task in a worker process (32 greenlets) to
+        # keep its own connection if the server falls back to HTTP/1.1
+        self.limits = httpx.Limits(max_connections=100, max_keepalive_connections=32)
+
+        # HTTP/2 client: keep-alive plus multiplexing of concurrent requests over one connection
+        self.client = httpx.Client(
+            http2=True,
+            base_url=self.base_url,
+            headers=self.headers,
+            limits=self.limits,
+            timeout=60.0
+        )
     
     def generate_content(self, prompt: str, **kwargs) -> str:
         """
@@ -32,65 +54,154 @@ class OpenRouterProvider(AIProvider):
             Generated content as string
         """
         try:
-            model = kwargs.get('model', 'anthropic/claude-sonnet-4')
-            temperature = kwargs.get('temperature', 0.7)
-            max_tokens = kwargs.get('max_tokens', 4000)
-            
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": "https://www.pocketvibe.app/",
-                "X-Title": "Pocket Vibe"
-            }
+            data = self._build_payload(prompt, **kwargs)
             
-            data = {
-                "model": model,
-                "messages": [
-                    {
-                        "role": "user", 
-                        "content": prompt
-                    }
-                ]
-                # "temperature": temperature,
-                # "max_tokens": max_tokens
-            }
-            
-            logger.info(f"[OpenRouter] Sending request to model: {model}")
-            response = requests.post(
-                url=f"{self.base_url}/chat/completions",
-                headers=headers,
-                json=data,
-                timeout=60
-            )
+            logger.info(f"[OpenRouter] Sending request to model: {data['model']}")
+            response = self._post("/chat/completions", data)
             
             if response.status_code != 200:
                 logger.error(f"[OpenRouter] API error: {response.status_code} - {response.text}")
                 raise Exception(f"OpenRouter API error: {response.status_code}")
             
-            response_data = response.json()
+            return self._extract_content(orjson.loads(response.content))
             
-            if not response_data or 'choices' not in response_data or not response_data['choices']:
-                raise Exception("Invalid response format from OpenRouter API")
+        except httpx.TimeoutException:
+            logger.error("[OpenRouter] Request timed out")
+            raise Exception("OpenRouter API request timed out")
+        except httpx.HTTPError as e:
+            logger.error(f"[OpenRouter] Request failed: {str(e)}")
+            raise Exception(f"OpenRouter API request failed: {str(e)}")
+        except Exception as e:
+            logger.error(f"[OpenRouter] Content generation failed: {str(e)}")
+            raise
+    
+    def stream_content(self, prompt: str, **kwargs) -> Iterator[str]:
+        """
+        Stream content from OpenRouter's API as it is generated
+        
+        Args:
+            prompt: The input prompt
+            **kwargs: Additional parameters (model, temperature, etc.)
             
-            content = response_data['choices'][0]['message']['content']
+        Returns:
+            Iterator over text chunks
+        """
+        try:
+            data = self._build_payload(prompt, **kwargs)
+            data["stream"] = True
             
-            # Log usage information if available
-            if 'usage' in response_data:
-                usage = response_data['usage']
-                logger.info(f"[OpenRouter] Usage - Tokens: {usage.get('total_tokens', 'unknown')}")
+            logger.info(f"[OpenRouter] Streaming request to model: {data['model']}")
+            with self.client.stream("POST", "/chat/completions", content=orjson.dumps(data)) as response:
+                if response.status_code != 200:
+                    response.read()
+                    logger.error(f"[OpenRouter] API error: {response.status_code} - {response.text}")
+                    raise Exception(f"OpenRouter API error: {response.status_code}")
+                
+                # Server-sent events: "data: {...}" lines, ending with "data: [DONE]"
+                for line in response.iter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    payload = line[len("data: "):]
+                    if payload == "[DONE]":
+                        break
+                    chunk = orjson.loads(payload)
+                    if chunk.get('choices'):
+                        text = chunk['choices'][0].get('delta', {}).get('content')
+                        if text:
+                            yield text
             
-            return content
+        except httpx.TimeoutException:
+            logger.error("[OpenRouter] Request timed out")
+            raise Exception("OpenRouter API request timed out")
+        except httpx.HTTPError as e:
+            logger.error(f"[OpenRouter] Request failed: {str(e)}")
+            raise Exception(f"OpenRouter API request failed: {str(e)}")
+        except Exception as e:
+            logger.error(f"[OpenRouter] Content streaming failed: {str(e)}")
+            raise
+    
+    async def agenerate_content(self, prompt: str, **kwargs) -> str:
+        """
+        Asynchronously generate content using OpenRouter's API
+        
+        Args:
+            prompt: The input prompt
+            **kwargs: Additional parameters (model, temperature, etc.)
+            
+        Returns:
+            Generated content as string
+        """
+        try:
+            data = self._build_payload(prompt, **kwargs)
+            client = self._get_async_client(lambda: httpx.AsyncClient(
+                http2=True,
+                base_url=self.base_url,
+                headers=self.headers,
+                limits=self.limits,
+                timeout=60.0
+            ))
+            
+            logger.info(f"[OpenRouter] Sending async request to model: {data['model']}")
+            response = await self._apost(client, "/chat/completions", data)
             
-        except requests.exceptions.Timeout:
+            if response.status_code != 200:
+                logger.error(f"[OpenRouter] API error: {response.status_code} - {response.text}")
+                raise Exception(f"OpenRouter API error: {response.status_code}")
+            
+            return self._extract_content(orjson.loads(response.content))
+            
+        except httpx.TimeoutException:
             logger.error("[OpenRouter] Request timed out")
             raise Exception("OpenRouter API request timed out")
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"[OpenRouter] Request failed: {str(e)}")
             raise Exception(f"OpenRouter API request failed: {str(e)}")
         except Exception as e:
             logger.error(f"[OpenRouter] Content generation failed: {str(e)}")
             raise
     
+    @retry_transient
+    def _post(self, url: str, data: dict) -> httpx.Response:
+        """POST with exponential backoff on transient network errors and 429/5xx responses"""
+        return self.client.post(url, content=orjson.dumps(data))
+    
+    @retry_transient
+    async def _apost(self, client: httpx.AsyncClient, url: str, data: dict) -> httpx.Response:
+        """Async POST with exponential backoff on transient network errors and 429/5xx responses"""
+        return await client.post(url, content=orjson.dumps(data))
+    
+    def _build_payload(self, prompt: str, **kwargs) -> dict:
+        """Build the chat completions request body"""
+        model = kwargs.get('model', 'anthropic/claude-sonnet-4')
+        temperature = kwargs.get('temperature', 0.7)
+        max_tokens = kwargs.get('max_tokens', 4000)
+        
+        return {
+            "model": model,
+            "messages": [
+                {
+                    "role": "user", 
+                    "content": prompt
+                }
+            ]
+            # "temperature": temperature,
+            # "max_tokens": max_tokens
+        }
+    
+    def _extract_content(self, response_data: dict) -> str:
+        """Pull the generated text out of a chat completions response"""
+        if not response_data or 'choices' not in response_data or not response_data['choices']:
+            raise Exception("Invalid response format from OpenRouter API")
+        
+        content = response_data['choices'][0]['message']['content']
+        
+        # Log usage information if available
+        if 'usage' in response_data and logger.isEnabledFor(logging.INFO):
+            usage = response_data['usage']
+            logger.info("[OpenRouter] Usage - Tokens: %s", usage.get('total_tokens', 'unknown'))
+        
+        return content
+    
     def generate_image(self, prompt: str, **kwargs) -> str:
         """
         Generate an image using OpenRouter's image generation
@@ -119,8 +230,8 @@ class OpenRouterProvider(AIProvider):
         return "openrouter"
     
     @classmethod
-    def get_required_env_vars(cls) -> list[str]:
-        return ["openrouterapikey"]
+    def get_required_env_vars(cls) -> tuple[str, ...]:
+        return REQUIRED_ENV_VARS
 
 if __name__ == "__main__":
     provider = OpenRouterProvider()
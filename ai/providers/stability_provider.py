@@ -1,25 +1,21 @@
 """
 Stability AI provider implementation
 """
-import requests
+import httpx
 import base64
+import orjson
+import io
 import time
 import os
 import logging
-import sys
-from pathlib import Path
-
-# Add the root directory to the Python path
-root_dir = str(Path(__file__).parent.parent.parent)
-if root_dir not in sys.path:
-    sys.path.append(root_dir)
 
 from ..base import AIProvider
-from PIL import Image
-from cloud import serverlink
+from ..retry import retry_transient
 
 logger = logging.getLogger(__name__)
 
+REQUIRED_ENV_VARS = ("stabilityaiapikey",)
+
 class StabilityAIProvider(AIProvider):
     """Stability AI implementation of AIProvider"""
     
@@ -28,6 +24,14 @@ class StabilityAIProvider(AIProvider):
         if not self.api_key:
             raise ValueError("stabilityaiapikey environment variable is not set")
 
+        # HTTP/2 client so sequential and concurrent image generations share a connection
+        self.client = httpx.Client(
+            http2=True,
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=32),
+            timeout=60.0
+        )
+
     def generate_content(self, prompt: str, **kwargs) -> str:
         """
         Generate content using Stability AI's API
@@ -43,7 +47,10 @@ class StabilityAIProvider(AIProvider):
 
     def generate_image(self, prompt: str, **kwargs) -> str:
         """Generate an image using Stability AI's API, resize it to 512x512px, and upload to S3"""
-        start = time.time()
+        # Imported here so Pillow and the S3 client are only loaded when an image is generated
+        from PIL import Image
+        from cloud import serverlink_fileobj
+        start = time.perf_counter()
         
         try:
             # $0.04 per image
@@ -80,14 +87,13 @@ class StabilityAIProvider(AIProvider):
             # image_data = response.content
 
             # $0.01 per image
-            response = requests.post(
+            response = self._post(
                 "https://api.stability.ai/v1/generation/stable-diffusion-v1-6/text-to-image",
                 headers={
                     "Content-Type": "application/json",
-                    "Accept": "application/json",
-                    "Authorization": f"Bearer {self.api_key}"
+                    "Accept": "application/json"
                 },
-                json={
+                content=orjson.dumps({
                     "text_prompts": [
                         {
                             "text": prompt
@@ -95,59 +101,52 @@ class StabilityAIProvider(AIProvider):
                     ],
                     "height": 512,
                     "width": 512
-                },
+                })
             )
-            base64_image = response.json()["artifacts"][0]["base64"]
-            image_data = base64.b64decode(base64_image)
-
             if response.status_code != 200:
-                raise Exception(f"Stability AI API error: {response.json()}")
+                raise Exception(f"Stability AI API error: {response.text}")
+
+            base64_image = orjson.loads(response.content)["artifacts"][0]["base64"]
+            image_data = base64.b64decode(base64_image)
 
             # Generate a unique filename using timestamp
             timestamp = int(time.time())
-            temp_filename = f"temp_icon_{timestamp}.png"
-            temp_filepath = f"./static/icons/{temp_filename}"
             final_filename = f"icon_{timestamp}.png"
             
-            # Save the temporary image
-            with open(temp_filepath, 'wb') as file:
-                file.write(image_data)
-            
-            # Resize the image to 512x512
-            with Image.open(temp_filepath) as img:
-                resized_img = img.resize((512, 512), Image.Resampling.LANCZOS)
-                resized_img.save(temp_filepath, quality=95)
+            # Resize the image to 512x512 in memory; Image.open only reads the
+            # header, so a PNG already at the target size is uploaded untouched
+            with Image.open(io.BytesIO(image_data)) as img:
+                if img.size == (512, 512) and img.format == 'PNG':
+                    output = io.BytesIO(image_data)
+                else:
+                    resized_img = img.resize((512, 512), Image.Resampling.LANCZOS)
+                    output = io.BytesIO()
+                    resized_img.save(output, format='PNG', optimize=True)
+            output.seek(0)
             
             # Upload to S3
-            s3_url = serverlink(temp_filepath, final_filename)
+            s3_url = serverlink_fileobj(output, final_filename)
             
-            # Clean up the temporary file
-            try:
-                os.remove(temp_filepath)
-            except Exception as e:
-                logger.warning(f"Failed to remove temporary file {temp_filepath}: {str(e)}")
-            
-            logger.info(f"Image generation, resizing, and upload completed in {round(time.time() - start, 2)} seconds")
+            logger.info("Image generation, resizing, and upload completed in %.2f seconds", time.perf_counter() - start)
             
             return s3_url
             
         except Exception as e:
             logger.error(f"Stability AI image generation failed: {str(e)}")
-            # Clean up temporary file in case of error
-            if 'temp_filepath' in locals():
-                try:
-                    os.remove(temp_filepath)
-                except:
-                    pass
             raise
     
+    @retry_transient
+    def _post(self, url: str, **kwargs) -> httpx.Response:
+        """POST with exponential backoff on transient network errors and 429/5xx responses"""
+        return self.client.post(url, **kwargs)
+    
     @classmethod
     def get_provider_name(cls) -> str:
         return "stability"
     
     @classmethod
-    def get_required_env_vars(cls) -> list[str]:
-        return ["stabilityaiapikey"]
+    def get_required_env_vars(cls) -> tuple[str, ...]:
+        return REQUIRED_ENV_VARS
 
 # Keep the original function for backward compatibility
 def textToImageStability(prompt, siteID):
@@ -0,0 +1,17 @@
+"""
+Retry policy shared by the httpx-based providers
+"""
+import httpx
+from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type, retry_if_result
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Exponential backoff on transport errors and 429/5xx responses (up to 3 attempts).
+# Works on both sync and async functions returning an httpx.Response; once
+# attempts run out the last response is returned for the caller to report.
+retry_transient = retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(multiplier=1, min=1, max=10),
+    retry=retry_if_exception_type(httpx.TransportError) | retry_if_result(lambda r: r.status_code in RETRY_STATUS_CODES),
+    retry_error_callback=lambda state: state.outcome.result(),
+)
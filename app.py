@@ -16,14 +16,21 @@ Main Components:
 - Caching: Redis-based response caching
 """
 
-from flask import Flask, render_template, request, jsonify, Response, send_from_directory, make_response
+from flask import Flask, render_template, request, jsonify, Response, send_from_directory, make_response, stream_with_context
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
-import os, re, json, time, uuid, logging, bleach
+import os, re, json, time, uuid, queue, logging, bleach, hashlib, functools, orjson, decimal, threading
 from lightningpay import lightning_quote, invoice_status
-from ai.factory import AIProviderFactory
-from db import get_db, init_db, Site, Waitlist, Contact, CSSGeneration, PushSubscription
-from tasks import generate_site_task, generate_css_task
+from db import get_db, get_ro_db, retry_db, init_db, Site, Waitlist, Contact, CSSGeneration, IconGeneration, PushSubscription
+from tasks import generate_site_task, generate_css_task, generate_icon_task
+from worker_setup import enqueue
+from events import status_listener, notify_status, SITE_STATUS_CHANNEL, CSS_STATUS_CHANNEL
+from helpers import stream_ai_service, compress_content, build_site_manifest, invalidate_custom_icon_url, touch_push_subscription, invalidate_active_push_subscriptions
 from datetime import datetime
+from string import Template
+from cachetools import TTLCache
+from sqlalchemy import func, cast, Integer, update, select, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 # ======================
 # Application Setup
@@ -33,7 +40,33 @@ from datetime import datetime
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson for request parsing and jsonify responses"""
+    
+    @staticmethod
+    def _default(obj):
+        # Types the stdlib provider handled that orjson doesn't
+        if isinstance(obj, decimal.Decimal):
+            return str(obj)
+        if hasattr(obj, '__html__'):
+            return str(obj.__html__())
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self._default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self._default, option=orjson.OPT_NON_STR_KEYS),
+            mimetype='application/json'
+        )
+
 app = Flask(__name__, static_folder='static')
+app.json = OrjsonProvider(app)
 CORS(app)
 
 # Configure VAPID keys from environment variables
@@ -41,6 +74,84 @@ app.config['VAPID_PUBLIC_KEY'] = os.environ.get('VAPID_PUBLIC_KEY')
 app.config['VAPID_PRIVATE_KEY'] = os.environ.get('VAPID_PRIVATE_KEY')
 app.config['VAPID_MAILTO'] = os.environ.get('VAPID_MAILTO')
 
+# Site ids this process has created recently, so a repeated generate-site
+# call can be rejected without a database round trip
+_recent_site_ids = TTLCache(maxsize=100_000, ttl=3600)
+_recent_site_ids_lock = threading.Lock()
+
+# Longest a status stream stays open; matches the site generation time limit
+STATUS_STREAM_TIMEOUT = 15 * 60
+
+# Patterns and templates used per request, compiled once
+_SITE_ID_RE = re.compile(r'^pv_[a-f0-9]{8}$')
+# URL-safe app names: letters, numbers and hyphens, with at least one non-hyphen;
+# the leading run only takes hyphens, so a failed match can't backtrack quadratically
+_APP_NAME_RE = re.compile(r'-*[a-z0-9][a-z0-9-]*')
+# Longest app name accepted (one DNS label), checked before the pattern runs
+MAX_APP_NAME_LENGTH = 63
+# Manifest, icon and apple-touch-icon <link> tags, matched in a single pass
+_HEAD_LINKS_RE = re.compile(
+    r'<link\s+rel="(?:(?P<manifest>manifest)"\s+href="[^"]*"'
+    r'|(?P<icon>icon|apple-touch-icon)"\s+href="[^"]*"[^>]*)>'
+)
+
+# PWA wrapper served by /appify
+_APPIFY_TEMPLATE = Template('''
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Appified Website</title>
+    <link rel="manifest" href="/site/$site_id/manifest.json">
+    <meta name="theme-color" content="#121212"/>
+    <meta name="description" content="Appified website using PocketVibe"/>
+    <meta name="mobile-web-app-capable" content="yes">
+    <link rel="apple-touch-icon" href="/static/icons/pocketvibe.png" type="image/png">
+    <style>
+        body, html {
+            margin: 0;
+            padding: 0;
+            width: 100%;
+            height: 100%;
+            overflow: hidden;
+        }
+        iframe {
+            width: 100%;
+            height: 100%;
+            border: none;
+        }
+    </style>
+    <script>
+        // Register service worker
+        if ('serviceWorker' in navigator) {
+            window.addEventListener('load', () => {
+                navigator.serviceWorker.register('/site/$site_id/sw.js')
+                    .then(reg => console.log('Service worker registered'))
+                    .catch(err => console.log('Service worker registration failed', err));
+            });
+        }
+    </script>
+</head>
+<body>
+    <iframe src="$target_url" allow="fullscreen" allowfullscreen></iframe>
+</body>
+</html>
+''')
+
+@retry_db
+def _fail_unqueued(model, item_id, channel=None, **values):
+    """Mark a generation whose task could not be queued as failed, so its status polls and streams end"""
+    with get_db() as db:
+        updated = db.execute(
+            update(model)
+            .where(model.id == item_id, model.status == 'processing')
+            .values(status='error', **values)
+        ).rowcount
+        if updated and channel:
+            notify_status(db, channel, item_id)
+        db.commit()
+
 # ======================
 # API Endpoints
 # ======================
@@ -55,14 +166,26 @@ def index():
 def manifest():
     return send_from_directory('static', 'manifest.json')
 
+# Root service worker, read once and served with a content hash ETag
+with open('service-worker.js', 'rb') as f:
+    SW_BYTES = f.read()
+SW_ETAG = hashlib.blake2b(SW_BYTES, digest_size=16).hexdigest()
+
+def javascript_response(body, etag, **headers):
+    """Serve JavaScript with a strong ETag and long-lived caching, answering 304 when it matches"""
+    response = Response(body, mimetype='application/javascript', headers=headers)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response.make_conditional(request)
+
 @app.route('/service-worker.js')
 def service_worker():
-    response = make_response(
-        # Send from local directory instead of static folder
-        send_from_directory('.', 'service-worker.js')
-    )
-    response.headers['Service-Worker-Allowed'] = '/'
-    return response
+    if app.debug:
+        # Pick up edits to the file without restarting the dev server
+        response = make_response(send_from_directory('.', 'service-worker.js'))
+        response.headers['Service-Worker-Allowed'] = '/'
+        return response
+    return javascript_response(SW_BYTES, SW_ETAG, **{'Service-Worker-Allowed': '/'})
 
 @app.route('/api/generate-site', methods=['POST'])
 def generate_site():
@@ -85,72 +208,78 @@ def generate_site():
         site_id = data['site_id']
         
         # Validate site_id format
-        if not re.match(r'^pv_[a-f0-9]{8}$', site_id):
+        if not _SITE_ID_RE.match(site_id):
             return jsonify({"message": "Invalid site_id format"}), 400
+        
+        with _recent_site_ids_lock:
+            if site_id in _recent_site_ids:
+                return jsonify({"message": "Site ID already exists"}), 409
             
-        # Check if site_id already exists
+        # Subscription upsert and site insert share one transaction
         with get_db() as db:
-            existing_site = db.query(Site).filter(Site.id == site_id).first()
-            if existing_site:
-                return jsonify({"message": "Site ID already exists"}), 409
-        
-        logger.info(f"[Request] Using client-provided site_id: {site_id}")
-        
-        # Handle subscription if provided
-        subscription_id = None
-        if data.get('subscription'):
-            try:
-                with get_db() as db:
-                    # Check if subscription already exists
-                    existing_sub = db.query(PushSubscription).filter_by(
-                        endpoint=data['subscription']['endpoint']
-                    ).first()
-                    
-                    if existing_sub:
-                        subscription_id = existing_sub.id
-                        # Update last_used timestamp
-                        existing_sub.last_used = datetime.utcnow()
-                    else:
-                        # Create new subscription
-                        new_sub = PushSubscription(
-                            endpoint=data['subscription']['endpoint'],
+            # Handle subscription if provided
+            subscription_id = None
+            if data.get('subscription'):
+                try:
+                    # Savepoint so a bad subscription doesn't abort the site insert
+                    with db.begin_nested():
+                        # Insert the subscription; a known endpoint only has its id
+                        # looked up, and its last_used bump is batched
+                        endpoint = data['subscription']['endpoint']
+                        sub_stmt = pg_insert(PushSubscription).values(
+                            endpoint=endpoint,
                             auth=data['subscription']['keys']['auth'],
                             p256dh=data['subscription']['keys']['p256dh'],
                             user_agent=request.headers.get('User-Agent')
-                        )
-                        db.add(new_sub)
-                        db.flush()  # Get the ID without committing
-                        subscription_id = new_sub.id
+                        ).on_conflict_do_nothing(
+                            index_elements=['endpoint']
+                        ).returning(PushSubscription.id)
+                        subscription_id = db.execute(sub_stmt).scalar()
+                        if subscription_id is None:
+                            subscription_id = db.execute(
+                                select(PushSubscription.id).where(PushSubscription.endpoint == endpoint)
+                            ).scalar_one()
+                            touch_push_subscription(endpoint)
                     
-                    db.commit()
                     logger.info(f"[Request] Subscription handled: {subscription_id}")
-            except Exception as sub_error:
-                logger.error(f"[Error] Failed to handle subscription: {str(sub_error)}")
-                # Continue without subscription - don't fail the request
-        
-        # Create initial site record with 'processing' status
-        try:
-            with get_db() as db:
-                site = Site(
+                except Exception as sub_error:
+                    subscription_id = None
+                    logger.error(f"[Error] Failed to handle subscription: {str(sub_error)}")
+                    # Continue without subscription - don't fail the request
+            
+            # Create initial site record with 'processing' status; the conflict
+            # clause makes the duplicate check atomic with the insert
+            try:
+                site_stmt = pg_insert(Site).values(
                     id=site_id,
                     status='processing',
                     created_at=datetime.utcnow(),
                     subscription_id=subscription_id
-                )
-                db.add(site)
+                ).on_conflict_do_nothing(index_elements=['id']).returning(Site.id)
+                
+                if db.execute(site_stmt).scalar() is None:
+                    db.rollback()
+                    return jsonify({"message": "Site ID already exists"}), 409
+                
                 db.commit()
+                with _recent_site_ids_lock:
+                    _recent_site_ids[site_id] = True
                 logger.info(f"[Request] Created site record with ID: {site_id}")
-        except Exception as db_error:
-            logger.error(f"[Error] Failed to create site record: {str(db_error)}")
-            return jsonify({
-                "status": "error",
-                "message": "Failed to initialize site generation"
-            }), 500
+            except Exception as db_error:
+                db.rollback()
+                logger.error(f"[Error] Failed to create site record: {str(db_error)}")
+                return jsonify({
+                    "status": "error",
+                    "message": "Failed to initialize site generation"
+                }), 500
         
         # Start the Dramatiq task
         logger.info("[Request] Starting Dramatiq task")
         task_start_time = time.time()
-        generate_site_task.send(site_id, data['prompt'])
+        enqueue(
+            generate_site_task, site_id, data['prompt'],
+            on_failure=functools.partial(_fail_unqueued, Site, site_id, SITE_STATUS_CHANNEL)
+        )
         task_duration = time.time() - task_start_time
         
         total_duration = time.time() - start_time
@@ -170,73 +299,115 @@ def generate_site():
             "message": str(e)
         }), 500
 
+@app.route('/api/stream-site', methods=['POST'])
+def stream_site():
+    """
+    Streams generated website HTML to the browser as the AI produces it
+    Sent as server-sent events: one JSON-encoded text chunk per 'data:' frame,
+    followed by a 'done' event (or an 'error' event on failure)
+    """
+    data = request.get_json()
+    if not data or 'prompt' not in data:
+        return jsonify({"message": "No prompt provided"}), 400
+
+    prompt = data['prompt']
+    logger.info("[Request] Received stream-site request")
+
+    def generate():
+        try:
+            for chunk in stream_ai_service(prompt):
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            logger.error(f"[Error] Site stream failed: {str(e)}")
+            yield f"event: error\ndata: {json.dumps(str(e))}\n\n"
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+
 @app.route('/site/<site_id>', methods=['GET'])
-# @cache_response(timeout=31536000)  # Cache for 1 year
 def view_site(site_id):
     """Render a deployed site for visitors"""
     try:
-        with get_db() as db:
-            site = db.query(Site).filter(Site.id == site_id).first()
+        with get_ro_db() as db:
+            # Check the validator first so a revalidation never loads the content
+            site = db.execute(select(
+                Site.content_etag,
+                Site.content_br.isnot(None).label('has_br'),
+                Site.content_gz.isnot(None).label('has_gz')
+            ).where(Site.id == site_id)).first()
             
-            if site:
-                # Return the HTML content directly
-                return Response(site.content, mimetype='text/html')
-            else:
+            if site is None:
                 return render_template("site_not_found.html"), 404
             
+            # Serve the smallest precompressed copy the client accepts
+            if site.has_br and request.accept_encodings.quality('br') > 0:
+                encoding, column = 'br', Site.content_br
+            elif site.has_gz and request.accept_encodings.quality('gzip') > 0:
+                encoding, column = 'gzip', Site.content_gz
+            else:
+                encoding, column = None, Site.content
+            
+            # Each encoding is a separate representation with its own ETag
+            etag = site.content_etag
+            if etag and encoding:
+                etag = f"{etag}-{encoding}"
+            
+            if etag and request.if_none_match.contains(etag):
+                response = Response(status=304)
+            else:
+                # Return the HTML content directly
+                content = db.execute(select(column).where(Site.id == site_id)).scalar_one_or_none()
+                response = Response(content, mimetype='text/html')
+                if encoding:
+                    response.headers['Content-Encoding'] = encoding
+            
+            response.vary.add('Accept-Encoding')
+            # Sites still generating have no content (and no ETag) yet
+            if etag:
+                response.set_etag(etag)
+                response.headers['Cache-Control'] = 'public, max-age=31536000'
+            return response
+            
     except Exception as e:
         return f"Error loading site: {str(e)}", 500
 
 @app.route('/site/<site_id>/manifest.json', methods=['GET'])
-# @cache_response(timeout=31536000)  # Cache for 1 year
 def serve_site_manifest(site_id):
     """Serve the manifest.json for a specific user site"""
     try:
         # Fetch site data from database
-        with get_db() as db:
-            site = db.query(Site).filter(Site.id == site_id).first()
-            
-            if not site:
-                return "Site not found", 404
-            
-            # Use the stored app_name from DB, or default to 'Super Cool App'
-            site_name = site.app_name if site.app_name else "Super Cool App"
-            short_name = site_name if len(site_name) <= 14 else site_name[:14]
-            
-            # Get icon URL from database
-            icon_url = site.icon_url if site.icon_url else "/static/icons/pocketvibe.png"
-            
-            # Create the manifest JSON
-            manifest = {
-                "name": site_name,
-                "short_name": short_name,
-                "description": f"Created with PocketVibe",
-                "start_url": f"/site/{site_id}",
-                "display": "standalone",
-                "background_color": "#121212",
-                "theme_color": "#121212",
-                "icons": [
-                    {
-                        "src": icon_url,
-                        "sizes": "512x512",
-                        "type": "image/png"
-                    }
-                ]
-            }
-            
-            return Response(
-                json.dumps(manifest),
-                mimetype='application/json'
-            )
+        with get_ro_db() as db:
+            site = db.execute(select(
+                Site.manifest_json, Site.app_name, Site.icon_url
+            ).where(Site.id == site_id)).first()
+        
+        if not site:
+            return "Site not found", 404
+        
+        if site.manifest_json:
+            # Serialized when the site was written
+            manifest_bytes = site.manifest_json
+            manifest_etag = hashlib.blake2b(manifest_bytes, digest_size=16).hexdigest()
+        else:
+            manifest_bytes, manifest_etag = build_site_manifest(site_id, site.app_name, site.icon_url)
+        response = Response(manifest_bytes, mimetype='application/json')
+        response.set_etag(manifest_etag)
+        response.headers['Cache-Control'] = 'public, max-age=31536000'
+        return response.make_conditional(request)
             
     except Exception as e:
         app.logger.error(f"Error serving manifest for site {site_id}: {str(e)}")
         return "Error generating manifest", 500
 
 @app.route('/site/<site_id>/sw.js')
-# @cache_response(timeout=31536000)  # Cache for 1 year
 def serve_service_worker(site_id):
     """Serve a service worker for the site"""
+    sw_bytes, sw_etag = build_site_service_worker(site_id)
+    return javascript_response(sw_bytes, sw_etag)
+
+@functools.lru_cache(maxsize=4096)
+def build_site_service_worker(site_id):
+    """Render the per-site service worker once; returns (bytes, etag)"""
     sw_content = f"""
     const CACHE_NAME = 'pocketvibe-site-{site_id}-v1';
     const SITE_URL = '/site/{site_id}';
@@ -333,25 +504,27 @@ def serve_service_worker(site_id):
     }});
     """
     
-    return Response(sw_content, mimetype='application/javascript')
+    sw_bytes = sw_content.encode('utf-8')
+    return sw_bytes, hashlib.blake2b(sw_bytes, digest_size=16).hexdigest()
 
 @app.route('/api/site-status/<site_id>', methods=['GET'])
 # @cache_response(timeout=30)  # Cache for 30 seconds
 def check_site_status(site_id):
     """Check the deployment status of a site"""
     try:
-        with get_db() as db:
+        with get_ro_db() as db:
             try:
-                site = db.query(Site).filter(Site.id == site_id).first()
+                # Status polls only need the status column, not the page content
+                status = db.execute(select(Site.status).where(Site.id == site_id)).first()
                 
-                if not site:
+                if not status:
                     return jsonify({
                         "status": "error",
                         "message": "Site not found"
                     }), 404
                 
                 return jsonify({
-                    "status": site.status,
+                    "status": status.status,
                     "site_id": site_id
                 })
 
@@ -374,6 +547,54 @@ def check_site_status(site_id):
             "message": str(e)
         }), 500
 
+def status_event_stream(channel, item_id, read_status):
+    """
+    Server-sent events for a background job's status
+    Sends the current status, then re-reads and sends it each time the worker
+    publishes a change, until it leaves 'processing' (or the stream times out)
+    """
+    def generate():
+        updates = status_listener.subscribe(channel, item_id)
+        try:
+            deadline = time.monotonic() + STATUS_STREAM_TIMEOUT
+            last_payload = None
+            while True:
+                payload, found = read_status()
+                if payload != last_payload:
+                    yield f"data: {json.dumps(payload)}\n\n"
+                    last_payload = payload
+                if not found or payload['status'] != 'processing':
+                    return
+                if time.monotonic() > deadline:
+                    yield "event: timeout\ndata: {}\n\n"
+                    return
+                # Wait for the next notification; every 15s without one, send a
+                # keep-alive and re-check in case one was missed during a reconnect
+                try:
+                    updates.get(timeout=15)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+        finally:
+            status_listener.unsubscribe(channel, item_id, updates)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/site-status/<site_id>/stream', methods=['GET'])
+def stream_site_status(site_id):
+    """Push site status changes instead of having the client poll"""
+    def read_status():
+        with get_ro_db() as db:
+            status = db.execute(select(Site.status).where(Site.id == site_id)).scalar_one_or_none()
+        if status is None:
+            return {"status": "error", "message": "Site not found"}, False
+        return {"status": status, "site_id": site_id}, True
+
+    return status_event_stream(SITE_STATUS_CHANNEL, site_id, read_status)
+
 @app.route('/api/generate-icon', methods=['POST'])
 def generate_icon():
     """Generate an icon using AI based on a text prompt"""
@@ -383,17 +604,22 @@ def generate_icon():
             return jsonify({"status": "error", "message": "No prompt provided"}), 400
 
         prompt = data['prompt']
+        icon_id = str(uuid.uuid4())
         
-        # Get the configured provider (default to OpenAI)
-        provider_name = os.getenv("AI_PROVIDER", "openai")
-        provider = AIProviderFactory.get_provider(provider_name)
+        # Store the initial status; the image is generated by a worker
+        with get_db() as db:
+            db.add(IconGeneration(id=icon_id, prompt=prompt, status='processing'))
+            db.commit()
         
-        # Generate image using the provider
-        icon_url = provider.generate_image(prompt)
+        logger.info(f"[Request] Starting icon generation task for icon_id: {icon_id}")
+        enqueue(
+            generate_icon_task, icon_id, prompt,
+            on_failure=functools.partial(_fail_unqueued, IconGeneration, icon_id, error="Icon generation could not be started")
+        )
             
         return jsonify({
-            "status": "success",
-            "icon_url": icon_url
+            "status": "processing",
+            "icon_id": icon_id
         })
         
     except Exception as e:
@@ -403,6 +629,27 @@ def generate_icon():
             "message": str(e)
         }), 500
 
+@app.route('/api/icon-status/<icon_id>', methods=['GET'])
+def check_icon_status(icon_id):
+    """Poll the status of an icon generation"""
+    try:
+        with get_ro_db() as db:
+            icon_gen = db.execute(select(
+                IconGeneration.status, IconGeneration.icon_url, IconGeneration.error
+            ).where(IconGeneration.id == icon_id)).first()
+        
+        if not icon_gen:
+            return jsonify({"status": "error", "message": "Icon generation not found"}), 404
+            
+        return jsonify({
+            "status": icon_gen.status,
+            "icon_url": icon_gen.icon_url if icon_gen.status == 'completed' else None,
+            "message": icon_gen.error if icon_gen.status == 'error' else None
+        })
+        
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
 @app.route('/api/update-app-icon', methods=['POST'])
 def update_app_icon():
     """Update app icon URL and modify HTML content"""
@@ -430,8 +677,15 @@ def update_app_icon():
         original_app_name = app_name.strip()
         base_app_url = original_app_name.lower().replace(' ', '-')
         
+        if len(base_app_url) > MAX_APP_NAME_LENGTH:
+            logger.error(f"Invalid app_name: longer than {MAX_APP_NAME_LENGTH} characters")
+            return jsonify({
+                "status": "error",
+                "message": f"App name can be at most {MAX_APP_NAME_LENGTH} characters"
+            }), 400
+        
         # Check for special characters in URL version
-        if not base_app_url.replace('-', '').isalnum():
+        if not _APP_NAME_RE.fullmatch(base_app_url):
             logger.error(f"Invalid app_name: {app_name} contains special characters")
             return jsonify({
                 "status": "error",
@@ -439,23 +693,24 @@ def update_app_icon():
             }), 400
 
         # Generate unique app_url by checking existing IDs
-        with get_db() as db:
-            # Get all existing IDs that start with our base_app_url
-            existing_ids = db.query(Site.id).filter(
+        with get_ro_db() as db:
+            # One row back: whether the bare name is taken and the highest
+            # numeric suffix in use (capped at 9 digits so the cast can't overflow)
+            base_taken, max_suffix = db.execute(select(
+                func.bool_or(Site.id == base_app_url),
+                func.max(
+                    cast(func.substr(Site.id, len(base_app_url) + 1), Integer)
+                ).filter(Site.id.op('~')(f"^{re.escape(base_app_url)}[0-9]{{1,9}}$"))
+            ).where(
                 Site.id.like(f"{base_app_url}%")
-            ).all()
-            existing_ids = [id[0] for id in existing_ids]  # Convert from tuple to list
+            )).one()
             
-            if not existing_ids:
+            if not base_taken and max_suffix is None:
                 # No conflicts, use base_app_url
                 app_url = base_app_url
             else:
-                # Find the next available number to append
-                # First try base_app_url1, then base_app_url2, etc.
-                counter = 1
-                while f"{base_app_url}{counter}" in existing_ids:
-                    counter += 1
-                app_url = f"{base_app_url}{counter}"
+                # Append the next number after the highest one in use
+                app_url = f"{base_app_url}{(max_suffix or 0) + 1}"
             
             logger.info(f"Generated unique app_url: {app_url} (base: {base_app_url})")
 
@@ -483,8 +738,8 @@ def update_app_icon():
 
         # Get current HTML content
         logger.info(f"Retrieving HTML content for site_id: {site_id}")
-        with get_db() as db:
-            site = db.query(Site).filter(Site.id == site_id).first()
+        with get_ro_db() as db:
+            site = db.execute(select(Site.content, Site.status).where(Site.id == site_id)).first()
         
         if not site:
             logger.error(f"Site not found for site_id: {site_id}")
@@ -512,36 +767,40 @@ def update_app_icon():
         # Update icon paths in HTML
         logger.info("Updating HTML content with new paths")
         
-        # Update manifest.json icon paths
-        manifest_pattern = r'<link\s+rel="manifest"\s+href="[^"]*">'
+        # Update manifest.json, regular icon and apple-touch-icon paths in one scan
         manifest_replacement = f'<link rel="manifest" href="/site/{app_url}/manifest.json">'
-        html_content = re.sub(manifest_pattern, manifest_replacement, html_content)
-        logger.info("Updated manifest.json path")
-
-        # Update regular icon
-        icon_pattern = r'<link\s+rel="icon"\s+href="[^"]*"[^>]*>'
-        icon_replacement = f'<link rel="icon" href="{image_url}" type="image/png">'
-        html_content = re.sub(icon_pattern, icon_replacement, html_content)
-        logger.info("Updated regular icon path")
-
-        # Update apple-touch-icon
-        apple_icon_pattern = r'<link\s+rel="apple-touch-icon"\s+href="[^"]*"[^>]*>'
-        apple_icon_replacement = f'<link rel="apple-touch-icon" href="{image_url}" type="image/png">'
-        html_content = re.sub(apple_icon_pattern, apple_icon_replacement, html_content)
-        logger.info("Updated apple-touch-icon path")
+        
+        def replace_link(match):
+            if match['manifest']:
+                return manifest_replacement
+            return f'<link rel="{match["icon"]}" href="{image_url}" type="image/png">'
+        
+        html_content = _HEAD_LINKS_RE.sub(replace_link, html_content)
+        logger.info("Updated manifest.json and icon paths")
 
         # Save updated content with new site_id (app_url), app_name, and icon_url
         logger.info(f"Saving updated content with new app_url: {app_url} and app_name: {original_app_name}")
         with get_db() as db:
-            new_site = Site(
+            insert_stmt = pg_insert(Site).values(
                 id=app_url,
                 content=html_content,
+                **compress_content(html_content),
+                manifest_json=build_site_manifest(app_url, original_app_name, image_url)[0],
                 status="success",
                 app_name=original_app_name,
                 icon_url=image_url
-            )
-            db.add(new_site)
+            ).on_conflict_do_nothing(index_elements=['id']).returning(Site.id)
+            
+            if db.execute(insert_stmt).scalar() is None:
+                # Another request claimed this app_url after we picked it
+                db.rollback()
+                logger.warning(f"app_url {app_url} was taken concurrently")
+                return jsonify({
+                    "status": "error",
+                    "message": "That app name was just taken. Please try again."
+                }), 409
             db.commit()
+        invalidate_custom_icon_url(app_url)
 
         logger.info(f"App icon update completed successfully for app_url: {app_url}")
         return jsonify({
@@ -586,12 +845,10 @@ def generate_css():
         
         # Start the Dramatiq task
         logger.info(f"[Request] Starting CSS generation task for css_id: {css_id}")
-        try:
-            generate_css_task.send(css_id, prompt, css_content)
-            logger.info(f"[Request] CSS generation task enqueued successfully")
-        except Exception as e:
-            logger.error(f"[Request] Failed to enqueue CSS generation task: {str(e)}")
-            raise
+        enqueue(
+            generate_css_task, css_id, prompt, css_content,
+            on_failure=functools.partial(_fail_unqueued, CSSGeneration, css_id, CSS_STATUS_CHANNEL, error="CSS generation could not be started")
+        )
         
         return jsonify({
             'css_id': css_id,
@@ -605,8 +862,10 @@ def generate_css():
 @app.route('/css-status/<css_id>', methods=['GET'])
 def check_css_status(css_id):
     try:
-        with get_db() as db:
-            css_gen = db.query(CSSGeneration).filter(CSSGeneration.id == css_id).first()
+        with get_ro_db() as db:
+            css_gen = db.execute(select(
+                CSSGeneration.status, CSSGeneration.css_content, CSSGeneration.error
+            ).where(CSSGeneration.id == css_id)).first()
         
         if not css_gen:
             return jsonify({'error': 'CSS generation not found'}), 404
@@ -620,6 +879,24 @@ def check_css_status(css_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/css-status/<css_id>/stream', methods=['GET'])
+def stream_css_status(css_id):
+    """Push CSS generation status changes instead of having the client poll"""
+    def read_status():
+        with get_ro_db() as db:
+            css_gen = db.execute(select(
+                CSSGeneration.status, CSSGeneration.css_content, CSSGeneration.error
+            ).where(CSSGeneration.id == css_id)).first()
+        if not css_gen:
+            return {'status': 'error', 'error': 'CSS generation not found'}, False
+        return {
+            'status': css_gen.status,
+            'css_content': css_gen.css_content if css_gen.status == 'completed' else None,
+            'error': css_gen.error if css_gen.status == 'error' else None
+        }, True
+
+    return status_event_stream(CSS_STATUS_CHANNEL, css_id, read_status)
+
 @app.route('/appify', methods=['POST'])
 def appify_website():
     """Create a PWA wrapper for any website"""
@@ -634,56 +911,25 @@ def appify_website():
         site_id = str(uuid.uuid4())[:8]
         
         # Create the PWA wrapper HTML
-        wrapper_html = f'''
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Appified Website</title>
-    <link rel="manifest" href="/site/{site_id}/manifest.json">
-    <meta name="theme-color" content="#121212"/>
-    <meta name="description" content="Appified website using PocketVibe"/>
-    <meta name="mobile-web-app-capable" content="yes">
-    <link rel="apple-touch-icon" href="/static/icons/pocketvibe.png" type="image/png">
-    <style>
-        body, html {{
-            margin: 0;
-            padding: 0;
-            width: 100%;
-            height: 100%;
-            overflow: hidden;
-        }}
-        iframe {{
-            width: 100%;
-            height: 100%;
-            border: none;
-        }}
-    </style>
-    <script>
-        // Register service worker
-        if ('serviceWorker' in navigator) {{
-            window.addEventListener('load', () => {{
-                navigator.serviceWorker.register('/site/{site_id}/sw.js')
-                    .then(reg => console.log('Service worker registered'))
-                    .catch(err => console.log('Service worker registration failed', err));
-            }});
-        }}
-    </script>
-</head>
-<body>
-    <iframe src="{target_url}" allow="fullscreen" allowfullscreen></iframe>
-</body>
-</html>
-'''
+        wrapper_html = _APPIFY_TEMPLATE.substitute(site_id=site_id, target_url=target_url)
         
         # Store in database
         with get_db() as db:
-            cursor = db.cursor()
-            cursor.execute(
-                "INSERT INTO sites (id, content, status) VALUES (?, ?, ?)",
-                (site_id, wrapper_html, "success")
-            )
+            insert_stmt = pg_insert(Site).values(
+                id=site_id,
+                content=wrapper_html,
+                **compress_content(wrapper_html),
+                manifest_json=build_site_manifest(site_id, None, None)[0],
+                status="success"
+            ).on_conflict_do_nothing(index_elements=['id']).returning(Site.id)
+            
+            if db.execute(insert_stmt).scalar() is None:
+                # Random 8-character id collided with an existing site
+                db.rollback()
+                return jsonify({
+                    "status": "error",
+                    "message": "Site ID already exists. Please try again."
+                }), 409
             db.commit()
         
         # Return the new URL
@@ -749,8 +995,11 @@ def check_invoice(invoice_id):
 def get_global_sites():
     """Get all site URLs from the database"""
     try:
-        with get_db() as db:
-            sites = db.query(Site).filter(Site.status == 'success').all()
+        with get_ro_db() as db:
+            # Select only the listed columns so the HTML content is never loaded
+            sites = db.execute(select(
+                Site.id, Site.app_name, Site.created_at, Site.icon_url
+            ).where(Site.status == 'success')).all()
             
             # Format the response with site details
             site_list = [{
@@ -884,31 +1133,35 @@ def subscribe():
         
         # Store or update the subscription in the database
         with get_db() as db:
-            # Check if subscription already exists
-            existing = db.query(PushSubscription).filter(
-                PushSubscription.endpoint == subscription['endpoint']
-            ).first()
-            
-            if existing:
-                # Update existing subscription
-                existing.auth = subscription['keys']['auth']
-                existing.p256dh = subscription['keys']['p256dh']
-                existing.user_agent = user_agent
-                existing.last_used = datetime.utcnow()
-                existing.is_active = 'active'
-                logger.info(f"Updated existing push subscription: {subscription['endpoint']}")
-            else:
-                # Create new subscription
-                new_sub = PushSubscription(
-                    endpoint=subscription['endpoint'],
-                    auth=subscription['keys']['auth'],
-                    p256dh=subscription['keys']['p256dh'],
-                    user_agent=user_agent
+            # Insert, or refresh keys and reactivate if the endpoint is already known;
+            # an unchanged re-subscribe writes nothing
+            stmt = pg_insert(PushSubscription).values(
+                endpoint=subscription['endpoint'],
+                auth=subscription['keys']['auth'],
+                p256dh=subscription['keys']['p256dh'],
+                user_agent=user_agent
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['endpoint'],
+                set_={
+                    'auth': stmt.excluded.auth,
+                    'p256dh': stmt.excluded.p256dh,
+                    'user_agent': stmt.excluded.user_agent,
+                    'is_active': 'active'
+                },
+                where=or_(
+                    PushSubscription.auth.is_distinct_from(stmt.excluded.auth),
+                    PushSubscription.p256dh.is_distinct_from(stmt.excluded.p256dh),
+                    PushSubscription.user_agent.is_distinct_from(stmt.excluded.user_agent),
+                    PushSubscription.is_active.is_distinct_from('active')
                 )
-                db.add(new_sub)
-                logger.info(f"Created new push subscription: {subscription['endpoint']}")
+            )
+            db.execute(stmt)
+            logger.info(f"Upserted push subscription: {subscription['endpoint']}")
             
             db.commit()
+        touch_push_subscription(subscription['endpoint'])
+        invalidate_active_push_subscriptions()
         
         return jsonify({'status': 'success'}), 200
         
@@ -932,14 +1185,16 @@ def unsubscribe():
 
         # Mark subscription as inactive in the database
         with get_db() as db:
-            existing = db.query(PushSubscription).filter(
-                PushSubscription.endpoint == endpoint
-            ).first()
+            result = db.execute(
+                update(PushSubscription)
+                .where(PushSubscription.endpoint == endpoint)
+                .values(is_active='inactive')
+            )
+            db.commit()
             
-            if existing:
-                existing.is_active = 'inactive'
-                existing.last_used = datetime.utcnow()
-                db.commit()
+            if result.rowcount:
+                touch_push_subscription(endpoint)
+                invalidate_active_push_subscriptions()
                 logger.info(f"Deactivated push subscription: {endpoint}")
             else:
                 logger.warning(f"Attempted to unsubscribe non-existent endpoint: {endpoint}")
@@ -3,15 +3,33 @@
 import os
 import boto3
 import time
+from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
 
 # Environment variables
 awssecret = os.environ["AWS_SECRET_ACCESS_KEY"]
 awsaccess = os.environ["AWS_ACCESS_KEY_ID"]
 
+# One S3 client for the process: creating a client loads the service model and
+# resolves credentials, which costs more than uploading a small icon
+_S3 = boto3.client(
+    's3',
+    region_name='us-west-1',
+    config=Config(max_pool_connections=50, retries={'max_attempts': 3, 'mode': 'adaptive'})
+)
+
+# Large assets go multipart with parts uploaded concurrently; S3 requires
+# parts of at least 5 MB, so small icons stay a single PUT
+_TX_CFG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=16,
+    use_threads=True
+)
+
 def serverlink(local_filepath, object_name='icon.png'):
     start = time.time()
-    # Create an S3 client
-    s3 = boto3.client('s3')
+    s3 = _S3
 
     filename = local_filepath  # This is the local file that you want to upload
     bucket_name = 'pocket-vibe'  # The name of your S3 bucket
@@ -20,13 +38,8 @@ def serverlink(local_filepath, object_name='icon.png'):
 
     # Uploads the given file using a managed uploader, which will split up large
     # files automatically and upload parts in parallel.
-    s3.upload_file(filename, bucket_name, object_name, ExtraArgs={'ContentType': "video/mp4", 'CacheControl': "max-age=31536000"})
-    try:
-        response = s3.head_object(Bucket=bucket_name, Key=object_name)
-        print(f"S3 file size: {response['ContentLength']} bytes")
-        print(f"Content type: {response.get('ContentType')}")
-    except Exception as e:
-        print(f"Error checking S3 object: {e}")
+    s3.upload_file(filename, bucket_name, object_name, ExtraArgs={'ContentType': "video/mp4", 'CacheControl': "max-age=31536000"}, Config=_TX_CFG)
+    print(f"S3 file size: {os.path.getsize(filename)} bytes")
 
     # Update the ACL to make the object publicly readable
     # s3.put_object_acl(
@@ -53,6 +66,23 @@ def serverlink(local_filepath, object_name='icon.png'):
 
     return url
 
+def serverlink_fileobj(fileobj, object_name='icon.png', content_type='image/png'):
+    """Upload an in-memory file-like object to S3 and return its public URL"""
+    start = time.time()
+    s3 = _S3
+
+    bucket_name = 'pocket-vibe'  # The name of your S3 bucket
+    region = 'us-west-1' # Region where the server resides
+
+    s3.upload_fileobj(fileobj, bucket_name, object_name, ExtraArgs={'ContentType': content_type, 'CacheControl': "max-age=31536000"}, Config=_TX_CFG)
+
+    # Create the public URL (active for 90 days controlled by lifecycle management)
+    url = f"https://{bucket_name}.s3.{region}.amazonaws.com/{object_name}"
+
+    print(f"Uploaded {object_name} successfully! ({round(time.time()-start,2)}s)")
+
+    return url
+
 if __name__ == "__main__":
     path = r"C:\Users\clayt\Videos\Pocket Vibe Demo Latest.mp4"
     name = 'pocketvibedemo.mp4'
@@ -1,10 +1,12 @@
-from sqlalchemy import create_engine, Column, String, DateTime, Text, ForeignKey
-from sqlalchemy.orm import declarative_base, sessionmaker, relationship
+from sqlalchemy import create_engine, Column, String, DateTime, Text, LargeBinary, ForeignKey, Computed, Index, text
+from sqlalchemy.orm import declarative_base, sessionmaker, relationship, deferred
+from sqlalchemy.exc import OperationalError, DBAPIError
+from psycopg2.errors import SerializationFailure, DeadlockDetected
 from contextlib import contextmanager
+from tenacity import retry, stop_after_attempt, wait_exponential, wait_random_exponential, retry_if_exception, retry_if_exception_type, before_sleep_log
 import time, os
 import logging
 from datetime import datetime
-import uuid
 
 logger = logging.getLogger(__name__)
 
@@ -12,12 +14,18 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 # Create SQLAlchemy engine with connection pooling and retry logic
 engine = create_engine(
     DATABASE_URL,
-    pool_size=5,  # Number of connections to keep open
-    max_overflow=10,  # Maximum number of connections that can be created beyond pool_size
-    pool_timeout=30,  # Seconds to wait before giving up on getting a connection from the pool
-    pool_recycle=1800,  # Recycle connections after 30 minutes
-    pool_pre_ping=True,  # Enable connection health checks
+    # Sized for concurrent web requests plus Dramatiq worker threads, and
+    # shared with the broker (worker_setup.EnginePool), which holds two per queue:
+    # roughly max_concurrent_requests + 2 * worker_threads + 2 * queues + 10
+    pool_size=int(os.getenv("DB_POOL_SIZE", "20")),  # Number of connections to keep open
+    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "40")),  # Maximum number of connections that can be created beyond pool_size
+    pool_timeout=5,  # Seconds to wait before giving up on getting a connection from the pool
+    pool_recycle=3600,  # Recycle connections after 60 minutes
+    # Health check (SELECT 1) on checkout; can be turned off under steady traffic
+    pool_pre_ping=os.getenv("DB_POOL_PRE_PING", "1") == "1",
     connect_args={
+        'application_name': os.getenv("DB_APPLICATION_NAME", "pocketvibe"),  # Shown in pg_stat_activity
+        'options': f"-c statement_timeout={os.getenv('DB_STATEMENT_TIMEOUT_MS', '15000')}",  # Cancel runaway queries
         'connect_timeout': 10,  # Connection timeout in seconds
         'keepalives': 1,  # Enable TCP keepalive
         'keepalives_idle': 30,  # Seconds between keepalive probes
@@ -27,25 +35,47 @@ engine = create_engine(
 )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Autocommit sessions for polling and page reads: no BEGIN/COMMIT round trips,
+# and the connection goes back to the pool as soon as it's released. Nothing
+# enforces read-only at the server (that would cost a SET on every checkout
+# and return), so only use them for queries that never write
+ReadSession = sessionmaker(
+    bind=engine.execution_options(isolation_level="AUTOCOMMIT"),
+    autoflush=False,
+    expire_on_commit=False
+)
 Base = declarative_base()
 
 # Define database models
 class Site(Base):
     __tablename__ = "sites"
+    __table_args__ = (
+        # Joins from a site to its push subscription
+        Index('ix_sites_subscription_id', 'subscription_id'),
+    )
     
     id = Column(String, primary_key=True)
-    content = Column(Text)
+    # Page bodies (and their compressed copies below) run to hundreds of KB;
+    # loading a Site entity leaves them unread until one is accessed
+    content = deferred(Column(Text), group="content")
     created_at = Column(DateTime, default=datetime.utcnow)
     status = Column(String, default='processing')
     app_name = Column(String)
     icon_url = Column(String)
+    # Kept in sync by Postgres so every write path gets a validator for conditional GETs
+    content_etag = Column(String, Computed("md5(content)", persisted=True))
+    # Precompressed copies of content, served directly when the client accepts them
+    content_gz = deferred(Column(LargeBinary), group="content")
+    content_br = deferred(Column(LargeBinary), group="content")
+    # Serialized manifest.json, written alongside the content
+    manifest_json = Column(LargeBinary)
     subscription_id = Column(String, ForeignKey('push_subscriptions.id'))
     subscription = relationship("PushSubscription", backref="sites")
 
 class Waitlist(Base):
     __tablename__ = "waitlist"
     
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = Column(String, primary_key=True, server_default=text("gen_random_uuid()::text"))
     contact = Column(String, nullable=False)
     type = Column(String, nullable=False)  # 'email' or 'npub'
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -60,10 +90,20 @@ class CSSGeneration(Base):
     error = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+class IconGeneration(Base):
+    __tablename__ = "icon_generations"
+    
+    id = Column(String, primary_key=True)
+    prompt = Column(Text, nullable=False)
+    status = Column(String, default='processing')
+    icon_url = Column(String)
+    error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class Contact(Base):
     __tablename__ = "contacts"
     
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = Column(String, primary_key=True, server_default=text("gen_random_uuid()::text"))
     contact = Column(String, nullable=True)  # Allow null values
     type = Column(String, nullable=True)  # Allow null values
     message = Column(Text, nullable=False)
@@ -71,8 +111,10 @@ class Contact(Base):
 
 class PushSubscription(Base):
     __tablename__ = "push_subscriptions"
+    # Endpoint lookups use the unique constraint's index; the fan-out reads
+    # every active row, which a sequential scan serves as well as any index
     
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = Column(String, primary_key=True, server_default=text("gen_random_uuid()::text"))
     endpoint = Column(String, nullable=False, unique=True)  # The push service endpoint URL
     auth = Column(String, nullable=False)  # Authentication secret
     p256dh = Column(String, nullable=False)  # Public key for encryption
@@ -90,37 +132,107 @@ class PushSubscription(Base):
             }
         }
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
+@contextmanager
+def get_db(**options):
+    """Get a database session; options override the sessionmaker defaults"""
+    db = SessionLocal(**options)
+    try:
+        yield db
+    finally:
+        db.close()
+
+# Retries a whole unit of work (open session, write, commit) on transient
+# connection errors. Only wrap functions that open their own session and are
+# safe to run again; a session that raised can't be reused mid-transaction.
+retry_db = retry(
+    retry=retry_if_exception_type(OperationalError),
+    wait=wait_exponential(multiplier=1, min=1, max=10),
+    stop=stop_after_attempt(3),
+    before_sleep=before_sleep_log(logger, logging.WARNING),
+    reraise=True,
+)
+
+def _is_transaction_conflict(exc):
+    return isinstance(exc, DBAPIError) and isinstance(exc.orig, (SerializationFailure, DeadlockDetected))
+
+# Retries a write that lost a serialization or deadlock conflict; these are
+# the only errors where running the same transaction again can succeed.
+# Dead connections are already handled by pool_pre_ping.
+retry_conflict = retry(
+    retry=retry_if_exception(_is_transaction_conflict),
+    wait=wait_random_exponential(multiplier=0.05, max=1.0),
+    stop=stop_after_attempt(3),
+    before_sleep=before_sleep_log(logger, logging.WARNING),
+    reraise=True,
+)
 
 @contextmanager
-def get_db():
-    """Get a database session with retry logic"""
-    db = SessionLocal()
-    max_retries = 3
-    retry_delay = 1  # seconds
-    
-    for attempt in range(max_retries):
-        try:
-            yield db
-            break
-        except Exception as e:
-            if attempt == max_retries - 1:  # Last attempt
-                logger.error(f"Database connection failed after {max_retries} attempts: {str(e)}")
-                raise
-            logger.warning(f"Database connection attempt {attempt + 1} failed: {str(e)}")
-            time.sleep(retry_delay * (attempt + 1))  # Exponential backoff
-        finally:
-            db.close()
+def get_ro_db():
+    """Get an autocommit session for queries that never write"""
+    db = ReadSession()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# Collapse duplicate push subscriptions left over from before endpoint was
+# unique, keeping the most recently used row and repointing sites at it
+_DEDUPE_PUSH_SUBSCRIPTIONS = """
+WITH ranked AS (
+    SELECT id,
+           first_value(id) OVER w AS keep_id,
+           row_number() OVER w AS rn
+    FROM push_subscriptions
+    WINDOW w AS (PARTITION BY endpoint ORDER BY last_used DESC NULLS LAST, created_at DESC NULLS LAST, id)
+), repointed AS (
+    UPDATE sites SET subscription_id = ranked.keep_id
+    FROM ranked
+    WHERE sites.subscription_id = ranked.id AND ranked.rn > 1
+)
+DELETE FROM push_subscriptions
+USING ranked
+WHERE push_subscriptions.id = ranked.id AND ranked.rn > 1
+"""
 
 def init_db():
-    """Initialize the database schema with retry logic"""
+    """
+    Initialize the database schema with retry logic.
+    Only runs with PV_INIT_DB=1 (set once at deploy), so web and worker
+    processes don't repeat the table introspection on every start.
+    """
+    if os.getenv("PV_INIT_DB") != "1":
+        return
+    
     max_retries = 3
     retry_delay = 1  # seconds
     
     for attempt in range(max_retries):
         try:
-            # Tables are created automatically by SQLAlchemy
+            Base.metadata.create_all(bind=engine)
+            # Columns added after a table exists need an explicit ALTER
+            with engine.begin() as conn:
+                conn.execute(text(
+                    "ALTER TABLE sites ADD COLUMN IF NOT EXISTS content_etag VARCHAR "
+                    "GENERATED ALWAYS AS (md5(content)) STORED"
+                ))
+                conn.execute(text("ALTER TABLE sites ADD COLUMN IF NOT EXISTS content_gz BYTEA"))
+                conn.execute(text("ALTER TABLE sites ADD COLUMN IF NOT EXISTS content_br BYTEA"))
+                conn.execute(text("ALTER TABLE sites ADD COLUMN IF NOT EXISTS manifest_json BYTEA"))
+                # Ids are generated by Postgres; tables created before that have no default
+                for table in ("waitlist", "contacts", "push_subscriptions"):
+                    conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT gen_random_uuid()::text"))
+                # Older tables may predate the unique endpoint constraint that
+                # the subscription upserts rely on
+                conn.execute(text(_DEDUPE_PUSH_SUBSCRIPTIONS))
+                conn.execute(text(
+                    "CREATE UNIQUE INDEX IF NOT EXISTS push_subscriptions_endpoint_key "
+                    "ON push_subscriptions (endpoint)"
+                ))
+                # create_all skips indexes on tables that already exist
+                for index in Site.__table__.indexes:
+                    index.create(conn, checkfirst=True)
+                # Partial index on the primary key, which no query could use
+                conn.execute(text("DROP INDEX IF EXISTS ix_push_sub_active"))
             logger.info("Database initialized successfully")
             break
         except Exception as e:
@@ -0,0 +1,98 @@
+"""
+Status change notifications over Postgres LISTEN/NOTIFY
+
+Workers publish a notification in the same transaction as a status update;
+each web process keeps one listening connection and wakes the SSE streams
+waiting on that id.
+"""
+import queue
+import select
+import logging
+import threading
+from collections import defaultdict
+
+from sqlalchemy import text
+from db import engine
+
+logger = logging.getLogger(__name__)
+
+SITE_STATUS_CHANNEL = "site_status"
+CSS_STATUS_CHANNEL = "css_status"
+CHANNELS = (SITE_STATUS_CHANNEL, CSS_STATUS_CHANNEL)
+
+def notify_status(db, channel, item_id):
+    """Queue a status notification; Postgres delivers it when the transaction commits"""
+    db.execute(text("SELECT pg_notify(:channel, :item_id)"), {"channel": channel, "item_id": item_id})
+
+class StatusListener:
+    """One LISTEN connection per process, fanned out to per-id subscriber queues"""
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self, channel, item_id):
+        """Register interest in an id; returns a queue that receives a wake-up per notification"""
+        q = queue.Queue()
+        with self._lock:
+            self._subscribers[(channel, item_id)].add(q)
+            # Started lazily so it runs in the serving process, not a pre-fork parent
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="status-listener", daemon=True)
+                self._thread.start()
+        return q
+
+    def unsubscribe(self, channel, item_id, q):
+        with self._lock:
+            subscribers = self._subscribers.get((channel, item_id))
+            if subscribers:
+                subscribers.discard(q)
+                if not subscribers:
+                    del self._subscribers[(channel, item_id)]
+
+    def _run(self):
+        """Listen forever, reconnecting after connection errors"""
+        while True:
+            try:
+                self._listen()
+            except Exception as e:
+                logger.error(f"Status listener failed, reconnecting: {str(e)}")
+                # Wake everyone so streams re-read the status rather than miss a change
+                self._wake_all()
+                threading.Event().wait(5)
+
+    def _listen(self):
+        # A dedicated connection, detached from the pool since it is held forever
+        raw = engine.raw_connection()
+        conn = raw.driver_connection
+        raw.detach()
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                for channel in CHANNELS:
+                    cursor.execute(f"LISTEN {channel}")
+            logger.info("Status listener connected")
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notification = conn.notifies.pop(0)
+                    self._wake(notification.channel, notification.payload)
+        finally:
+            conn.close()
+
+    def _wake(self, channel, item_id):
+        with self._lock:
+            subscribers = list(self._subscribers.get((channel, item_id), ()))
+        for q in subscribers:
+            q.put_nowait(True)
+
+    def _wake_all(self):
+        with self._lock:
+            subscribers = [q for qs in self._subscribers.values() for q in qs]
+        for q in subscribers:
+            q.put_nowait(True)
+
+status_listener = StatusListener()
@@ -0,0 +1,12 @@
+# Gunicorn settings, loaded automatically from the working directory
+
+# Most requests wait on Postgres, S3 or the AI providers, and the SSE endpoints
+# hold their connection open; gevent workers keep those waits from pinning a
+# whole thread each
+worker_class = "gevent"
+worker_connections = 250
+
+def post_fork(server, worker):
+    # Make psycopg2 yield to other greenlets while waiting on the database
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
@@ -1,26 +1,37 @@
 import os
 import re
+import gzip
+import zlib
 import time
+import atexit
+import brotli
+import orjson
+import hashlib
+import functools
+import threading
 import requests
 import logging
 from PIL import Image
 from io import BytesIO
+from cachetools import TTLCache, cached
+from cachetools.keys import hashkey
+from datetime import datetime
+from sqlalchemy import select, update, values, column, String, DateTime
 from ai.factory import AIProviderFactory
-from cloud import serverlink
-from db import get_db, Site
+from cloud import serverlink_fileobj
+from db import get_db, get_ro_db, retry_db, Site, PushSubscription
 
 logger = logging.getLogger(__name__)
 
+# Read once at import; restart the process to pick up changes
+AI_PROVIDER = os.getenv("AI_PROVIDER", "openrouter")
+
 # PWA Support
-def inject_pwa_support(html_content, site_id):
-    """
-    Injects PWA support into generated websites
-    Adds:
-    - Manifest link
-    - Service worker registration
-    - Meta tags for PWA support
-    """
-    pwa_elements = f"""
+_HEAD_CLOSE_RE = re.compile(r'</head\s*>', re.IGNORECASE)
+
+def _pwa_elements(site_id):
+    """Manifest link, service worker registration and PWA meta tags for a site's <head>"""
+    return f"""
     <link rel="manifest" href="/site/{site_id}/manifest.json">
     <meta name="theme-color" content="#121212"/>
     <meta name="description" content="Made with PocketVibe"/>
@@ -37,18 +48,190 @@ def inject_pwa_support(html_content, site_id):
       }}
     </script>
     """
+
+def inject_pwa_support(html_content, site_id):
+    """
+    Injects PWA support into generated websites
+    Adds:
+    - Manifest link
+    - Service worker registration
+    - Meta tags for PWA support
+    """
+    pwa_elements = _pwa_elements(site_id)
     
-    if "</head>" in html_content.lower():
-        return html_content.replace("</head>", pwa_elements + "</head>", 1)
+    # Insert before the first </head> in any case, keeping the original tag
+    html_content, found = _HEAD_CLOSE_RE.subn(lambda m: pwa_elements + m.group(0), html_content, count=1)
+    if found:
+        return html_content
     else:
         return f"<!DOCTYPE html><html><head>{pwa_elements}</head>{html_content}</html>"
     
 
+class SiteHtmlBuilder:
+    """
+    Applies strip_code_block and inject_pwa_support to a streamed AI response,
+    compressing each finished piece while the rest is still being generated
+
+    Text is buffered until </head> has been found (the PWA block goes before
+    it, or wraps the whole page if there is none); after that it is emitted as
+    it arrives, holding back a few characters in case a closing code fence is
+    split across chunks.
+    """
+
+    _FENCE_OPEN_RE = re.compile(r"```\w*\n")
+    _FENCE_CLOSE = "\n```"
+
+    def __init__(self, site_id):
+        self.site_id = site_id
+        self._pending = ""
+        self._parts = []
+        self._state = 'start'  # start -> head -> body
+        self._fenced = False
+        self._closed = False
+        self._head_scanned = 0
+        self._fence_scanned = 0
+        self._gz = zlib.compressobj(9, zlib.DEFLATED, 31)  # gzip container
+        self._br = brotli.Compressor(quality=11)
+        self._gz_parts = []
+        self._br_parts = []
+
+    def feed(self, chunk):
+        if self._closed or not chunk:
+            return
+        self._pending += chunk
+
+        if self._state == 'start':
+            # Need the whole first line to know whether the reply is fenced
+            if self._pending.startswith("```") or "```".startswith(self._pending):
+                if "\n" not in self._pending:
+                    return
+                match = self._FENCE_OPEN_RE.match(self._pending)
+                if match:
+                    self._fenced = True
+                    self._pending = self._pending[match.end():]
+            self._state = 'head'
+
+        if self._fenced:
+            end = self._pending.find(self._FENCE_CLOSE, max(0, self._fence_scanned - len(self._FENCE_CLOSE)))
+            self._fence_scanned = len(self._pending)
+            if end != -1:
+                self._pending = self._pending[:end]
+                self._closed = True
+
+        if self._state == 'head':
+            # Resume the search a little before the previous end, in case the tag was split
+            match = _HEAD_CLOSE_RE.search(self._pending, max(0, self._head_scanned - 16))
+            self._head_scanned = len(self._pending)
+            if not match:
+                return
+            head, self._pending = self._pending[:match.start()], self._pending[match.start():]
+            self._emit(head + _pwa_elements(self.site_id))
+            self._state = 'body'
+
+        hold = 0 if self._closed or not self._fenced else len(self._FENCE_CLOSE) - 1
+        if len(self._pending) > hold:
+            self._emit(self._pending[:len(self._pending) - hold])
+            self._pending = self._pending[len(self._pending) - hold:]
+            self._fence_scanned = len(self._pending)
+
+    def finish(self):
+        """Flush what's left; returns (html, compressed) like inject_pwa_support plus compress_content"""
+        if self._state == 'body':
+            self._emit(self._pending)
+        else:
+            # Never saw </head>: wrap the page in one
+            self._emit(f"<!DOCTYPE html><html><head>{_pwa_elements(self.site_id)}</head>{self._pending}</html>")
+        self._pending = ""
+        self._gz_parts.append(self._gz.flush())
+        self._br_parts.append(self._br.finish())
+        return "".join(self._parts), {
+            'content_gz': b"".join(self._gz_parts),
+            'content_br': b"".join(self._br_parts)
+        }
+
+    def _emit(self, text):
+        if not text:
+            return
+        self._parts.append(text)
+        raw = text.encode('utf-8')
+        self._gz_parts.append(self._gz.compress(raw))
+        self._br_parts.append(self._br.process(raw))
+
+def compress_content(html_content):
+    """Precompress site HTML once at write time; returns the content_gz/content_br column values"""
+    raw = html_content.encode('utf-8')
+    return {
+        'content_gz': gzip.compress(raw, compresslevel=9, mtime=0),
+        'content_br': brotli.compress(raw, quality=11)
+    }
+
+@functools.lru_cache(maxsize=8192)
+def build_site_manifest(site_id, app_name, icon_url):
+    """Serialize a site's manifest once per (site_id, app_name, icon_url); returns (bytes, etag)"""
+    # Use the stored app_name from DB, or default to 'Super Cool App'
+    site_name = app_name if app_name else "Super Cool App"
+    short_name = site_name if len(site_name) <= 14 else site_name[:14]
+    
+    # Get icon URL from database
+    icon_url = icon_url if icon_url else "/static/icons/pocketvibe.png"
+    
+    # Create the manifest JSON
+    manifest = {
+        "name": site_name,
+        "short_name": short_name,
+        "description": f"Created with PocketVibe",
+        "start_url": f"/site/{site_id}",
+        "display": "standalone",
+        "background_color": "#121212",
+        "theme_color": "#121212",
+        "icons": [
+            {
+                "src": icon_url,
+                "sizes": "512x512",
+                "type": "image/png"
+            }
+        ]
+    }
+    
+    manifest_bytes = orjson.dumps(manifest)
+    return manifest_bytes, hashlib.blake2b(manifest_bytes, digest_size=16).hexdigest()
+
 # Remove '''html''' from the beginning and end of the text
+_CODE_FENCE_RE = re.compile(r"```(?:\w+)?\n(.+?)\n```", re.DOTALL)
+
 def strip_code_block(text):
-    match = re.match(r"```(?:\w+)?\n(.+?)\n```", text, re.DOTALL)
+    # The pattern is anchored at the start, so unfenced text can skip the regex
+    if not text.startswith("```"):
+        return text
+    match = _CODE_FENCE_RE.match(text)
     return match.group(1) if match else text
 
+# Build the site generation prompt
+def _load_prompt_template():
+    """Read the prompt template from site_prompt.txt, or fall back to a built-in one"""
+    try:
+        with open('site_prompt.txt', 'r', encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        logger.warning("[AI Request] site_prompt.txt not found, using fallback prompt")
+        return """You are a LEGENDARY webapp builder. 
+Reply with complete web code only. 
+Do not explain yourself, respond with code only.
+Create a complete, valid using only HTML, CSS and Javascript.
+Only use photos when specifically needed for content (portfolio, gallery, product images).
+For icons and simple graphics, use embedded base64 SVG or Unicode symbols.
+Build mobile-first with relative units to work on all screen sizes.
+
+Here is the webapp description: 
+{prompt}"""
+
+# Loaded once at import; restart the process to pick up edits
+_PROMPT_TEMPLATE = _load_prompt_template()
+
+def build_site_prompt(prompt):
+    """Fill the site_prompt.txt template (or a fallback) with the user's description"""
+    return _PROMPT_TEMPLATE.format(prompt=prompt)
+
 # Function to call the AI service
 def call_ai_service(prompt):
     """
@@ -63,38 +246,20 @@ def call_ai_service(prompt):
     
     try:
         # Get the configured provider
-        provider_name = os.getenv("AI_PROVIDER", "openrouter")
-        provider = AIProviderFactory.get_provider(provider_name)
+        provider = AIProviderFactory.get_provider(AI_PROVIDER)
         
-        logger.info(f"[AI Request] Using provider: {provider_name}")
+        logger.info(f"[AI Request] Using provider: {AI_PROVIDER}")
         logger.info("[AI Request] Sending request to AI API")
         api_start_time = time.time()
         
-        # Read the prompt template from the text file
-        try:
-            with open('site_prompt.txt', 'r', encoding='utf-8') as f:
-                prompt_template = f.read()
-        except FileNotFoundError:
-            logger.warning("[AI Request] site_prompt.txt not found, using fallback prompt")
-            prompt_template = """You are a LEGENDARY webapp builder. 
-Reply with complete web code only. 
-Do not explain yourself, respond with code only.
-Create a complete, valid using only HTML, CSS and Javascript.
-Only use photos when specifically needed for content (portfolio, gallery, product images).
-For icons and simple graphics, use embedded base64 SVG or Unicode symbols.
-Build mobile-first with relative units to work on all screen sizes.
-
-Here is the webapp description: 
-{prompt}"""
-        
-        # Prepare the full prompt by replacing the placeholder
-        full_prompt = prompt_template.format(prompt=prompt)
+        # Prepare the full prompt from the template
+        full_prompt = build_site_prompt(prompt)
         
         # Generate content using the provider
-        result = provider.generate_content(full_prompt)
+        result = provider.generate_content_cached(full_prompt, cache_key=prompt)
         
         api_duration = time.time() - api_start_time
-        logger.info(f"[AI Response] Received response from {provider_name} API in {api_duration:.2f} seconds")
+        logger.info(f"[AI Response] Received response from {AI_PROVIDER} API in {api_duration:.2f} seconds")
 
         total_duration = time.time() - start_time
         logger.info(f"[AI Complete] Total AI processing completed in {total_duration:.2f} seconds")
@@ -105,6 +270,52 @@ Here is the webapp description:
         logger.error(f"[AI Error] Failed after {total_duration:.2f} seconds: {str(e)}")
         raise Exception(f"Failed to generate content: {str(e)}")
 
+# Function to stream from the AI service
+def stream_ai_service(prompt):
+    """
+    Streams website content from the configured AI provider as it is generated
+    Args:
+        prompt: User's description of the desired website
+    Returns:
+        Iterator over raw HTML chunks
+    """
+    provider = AIProviderFactory.get_provider(AI_PROVIDER)
+    logger.info(f"[AI Stream] Streaming from provider: {AI_PROVIDER}")
+    return provider.stream_content(build_site_prompt(prompt))
+
+
+def generate_site_html(prompt, site_id):
+    """
+    Generates a site's HTML with PWA support, plus its precompressed copies
+    Streams from the provider so stripping, PWA injection and compression
+    happen while the response is still arriving; the semantic cache only
+    stores whole responses, so it keeps the buffered path when enabled.
+    Args:
+        prompt: User's description of the desired website
+        site_id: Site the HTML is for
+    Returns:
+        (html, compressed) where compressed holds the content_gz/content_br column values
+    """
+    from ai.cache import semantic_cache
+    if semantic_cache.enabled:
+        html = inject_pwa_support(call_ai_service(prompt), site_id)
+        return html, compress_content(html)
+
+    start_time = time.time()
+    try:
+        builder = SiteHtmlBuilder(site_id)
+        for chunk in stream_ai_service(prompt):
+            builder.feed(chunk)
+        result = builder.finish()
+        logger.info(f"[AI Complete] Streamed site generation completed in {time.time() - start_time:.2f} seconds")
+        return result
+    except Exception as e:
+        logger.error(f"[AI Error] Failed after {time.time() - start_time:.2f} seconds: {str(e)}")
+        raise Exception(f"Failed to generate content: {str(e)}")
+
+
+# Largest icon source image that will be downloaded
+MAX_ICON_DOWNLOAD_BYTES = 10 * 1024 * 1024
 
 # App icon helper function
 def download_and_resize_image(image_url, app_name):
@@ -116,63 +327,139 @@ def download_and_resize_image(image_url, app_name):
     - Optimizes image quality
     - Handles transparency
     """
-    ICONS_DIR = "static/icons"
     try:
-        response = requests.get(image_url, timeout=10, stream=True)
-        response.raise_for_status()
+        with requests.get(image_url, timeout=10, stream=True) as response:
+            response.raise_for_status()
+            # Pillow needs a seekable file, so the body is buffered in memory;
+            # reading at most one byte past the cap keeps an oversized image
+            # from being downloaded in full
+            data = response.raw.read(MAX_ICON_DOWNLOAD_BYTES + 1, decode_content=True)
+        if len(data) > MAX_ICON_DOWNLOAD_BYTES:
+            raise ValueError(f"Image is larger than {MAX_ICON_DOWNLOAD_BYTES} bytes")
         
-        image_data = BytesIO()
-        for chunk in response.iter_content(chunk_size=8192):
-            image_data.write(chunk)
-        image_data.seek(0)
-        
-        img = Image.open(image_data)
+        img = Image.open(BytesIO(data))
+        # JPEGs are decoded at the smallest 1/2, 1/4 or 1/8 scale still at
+        # least 512px, so large photos never expand to full size in memory
+        img.draft(None, (512, 512))
+        img.load()
         
         if img.mode in ('RGBA', 'LA'):
             background = Image.new('RGB', img.size, (255, 255, 255))
             background.paste(img, mask=img.split()[-1])
             img = background
         
-        if img.size[0] > 512 or img.size[1] > 512:
-            ratio = min(512/img.size[0], 512/img.size[1])
-            new_size = tuple(int(dim * ratio) for dim in img.size)
-            img = img.resize(new_size, Image.Resampling.LANCZOS)
+        # Shrink in place to fit within 512x512, keeping the aspect ratio
+        img.thumbnail((512, 512), Image.Resampling.LANCZOS)
         
         new_img = Image.new('RGB', (512, 512), (255, 255, 255))
         offset = ((512 - img.size[0]) // 2, (512 - img.size[1]) // 2)
         new_img.paste(img, offset)
         
         filename = f"{app_name}.png"
-        filepath = os.path.join(ICONS_DIR, filename)
         
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        new_img.save(filepath, 'PNG', optimize=True, quality=85)
+        # Encode and upload from memory rather than round-tripping through disk
+        buffer = BytesIO()
+        new_img.save(buffer, 'PNG', optimize=True)
+        buffer.seek(0)
         
         try:
-            # url, _ = urlgenerator(filepath, app_name, alt="App Icon", MIME="image/png")
-            url = serverlink(filepath, filename)
-            return url
+            return serverlink_fileobj(buffer, filename)
         except Exception as e:
             logger.error(f"Error generating URL: {str(e)}")
             raise Exception(f"Error generating URL: {str(e)}")
-        finally:
-            # Clean up the temporary file
-            try:
-                os.remove(filepath)
-            except Exception as e:
-                logger.error(f"Error deleting temporary file: {str(e)}")
         
     except Exception as e:
         logger.error(f"Error processing image: {str(e)}")
         raise Exception(f"Failed to process image: {str(e)}")
 
+# Icon URLs rarely change; cache lookups per site_id for a few minutes
+_icon_cache = TTLCache(maxsize=10_000, ttl=300)
+_icon_cache_lock = threading.Lock()
+
+@cached(_icon_cache, lock=_icon_cache_lock)
 def get_custom_icon_url(site_id):
     """Check if a custom icon URL exists for the site and return it"""
+    with get_ro_db() as db:
+        # Only the icon column is needed; no ORM object or identity map entry
+        icon_url = db.execute(select(Site.icon_url).where(Site.id == site_id)).scalar_one_or_none()
+    return icon_url or None
+
+def invalidate_custom_icon_url(site_id):
+    """Drop a cached icon lookup after the site's icon_url is written"""
+    with _icon_cache_lock:
+        _icon_cache.pop(hashkey(site_id), None)
+
+# The active subscription set changes rarely; broadcasts read it from here
+# rather than querying the table for every notification
+_active_subs_cache = TTLCache(maxsize=1, ttl=30)
+_active_subs_lock = threading.Lock()
+
+@cached(_active_subs_cache, lock=_active_subs_lock)
+def get_active_push_subscriptions():
+    """Return subscription_info dicts for every active push subscription"""
+    with get_ro_db() as db:
+        rows = db.execute(
+            select(PushSubscription.endpoint, PushSubscription.auth, PushSubscription.p256dh)
+            .where(PushSubscription.is_active == 'active')
+        ).all()
+    return tuple({'endpoint': endpoint, 'keys': {'auth': auth, 'p256dh': p256dh}} for endpoint, auth, p256dh in rows)
+
+def invalidate_active_push_subscriptions():
+    """Drop the cached subscription list after a subscribe or unsubscribe"""
+    with _active_subs_lock:
+        _active_subs_cache.clear()
+
+# last_used is informational only; buffer touches per endpoint and write them
+# in one batched UPDATE instead of on every subscribe/unsubscribe call
+LAST_USED_FLUSH_INTERVAL = 10
+_last_used_buffer: dict[str, datetime] = {}
+_last_used_lock = threading.Lock()
+_last_used_flusher = None
+
+def touch_push_subscription(endpoint):
+    """Record that a push subscription was used; written on the next flush"""
+    global _last_used_flusher
+    with _last_used_lock:
+        _last_used_buffer[endpoint] = datetime.utcnow()
+        # Started lazily so it runs in the serving process, not a pre-fork parent
+        if _last_used_flusher is None or not _last_used_flusher.is_alive():
+            _last_used_flusher = threading.Thread(target=_flush_last_used_loop, name="last-used-flush", daemon=True)
+            _last_used_flusher.start()
+
+def flush_last_used():
+    """Write buffered last_used timestamps in a single UPDATE ... FROM (VALUES ...)"""
+    with _last_used_lock:
+        if not _last_used_buffer:
+            return
+        pending = list(_last_used_buffer.items())
+        _last_used_buffer.clear()
+
+    try:
+        _write_last_used(pending)
+    except Exception as e:
+        logger.error(f"Failed to flush last_used for {len(pending)} subscriptions: {str(e)}")
+        # Put them back unless a newer touch arrived meanwhile
+        with _last_used_lock:
+            for endpoint, ts in pending:
+                _last_used_buffer.setdefault(endpoint, ts)
+
+@retry_db
+def _write_last_used(pending):
+    touched = values(column('endpoint', String), column('ts', DateTime), name='v').data(pending)
     with get_db() as db:
-        site = db.query(Site).filter(Site.id == site_id).first()
-        if site and site.icon_url:
-            return site.icon_url
-    return None
+        db.execute(
+            update(PushSubscription)
+            .where(PushSubscription.endpoint == touched.c.endpoint)
+            .values(last_used=touched.c.ts)
+        )
+        db.commit()
+
+def _flush_last_used_loop():
+    while True:
+        time.sleep(LAST_USED_FLUSH_INTERVAL)
+        flush_last_used()
+
+atexit.register(flush_last_used)
 
 if __name__ == "__main__":
     prompt = "A website for a small business that sells handmade jewelry"
@@ -113,9 +113,30 @@ retryIconBtn.addEventListener('click', async () => {
               })
           });
           
-          const generateResult = await generateResponse.json();
+          let generateResult = await generateResponse.json();
+          if (!generateResponse.ok) {
+              throw new Error(generateResult.message || 'Failed to generate icon');
+          }
+          
+          // Icon is generated in the background; poll until it's ready, giving
+          // up after the task's 5 minute time limit (150 polls, 2s apart) in
+          // case the worker died before it could record a result
+          const iconId = generateResult.icon_id;
+          const maxPolls = 150;
+          let polls = 0;
+          while (generateResult.status === 'processing') {
+              if (++polls > maxPolls) {
+                  throw new Error('Icon generation timed out');
+              }
+              await new Promise(resolve => setTimeout(resolve, 2000));
+              const statusResponse = await fetch(`/api/icon-status/${iconId}`);
+              if (!statusResponse.ok) {
+                  throw new Error(`Failed to check icon status (HTTP ${statusResponse.status})`);
+              }
+              generateResult = await statusResponse.json();
+          }
           
-          if (generateResult.status === 'success') {
+          if (generateResult.status === 'completed') {
               await new Promise((resolve, reject) => {
                   const tempImage = new Image();
                   tempImage.onload = () => {
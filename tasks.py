@@ -1,187 +1,305 @@
 # tasks.py
 import time, os
 import dramatiq
+from dramatiq.middleware.time_limit import TimeLimitExceeded
 import logging
 from worker_setup import broker  # ensure this initializes Dramatiq
-from helpers import call_ai_service, inject_pwa_support  # your custom functions
+from helpers import generate_site_html, build_site_manifest, download_and_resize_image  # your custom functions
 from helpers import strip_code_block  # your util to clean response
-from db import get_db, Site, CSSGeneration, PushSubscription
-from pywebpush import webpush, WebPushException
+from helpers import get_active_push_subscriptions, invalidate_active_push_subscriptions
+from db import get_db, get_ro_db, retry_conflict, Site, CSSGeneration, IconGeneration, PushSubscription
+from pywebpush import WebPusher, WebPushException
+from py_vapid import Vapid
+from urllib.parse import urlparse
+import httpx
 from ai.factory import AIProviderFactory
-import json
+from events import notify_status, SITE_STATUS_CHANNEL, CSS_STATUS_CHANNEL
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import select, update, null
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+import orjson
+import functools
+import threading
+from cachetools import TTLCache, cached
+from string import Template
 
 logger = logging.getLogger(__name__)
 
-def send_push_notification(subscription, title, body, url=None):
-    """Send a push notification to a subscription"""
+# Read once at import; restart the worker to pick up changes
+AI_PROVIDER = os.getenv("AI_PROVIDER", "openrouter")
+# Icons default to OpenAI, which supports image generation
+IMAGE_AI_PROVIDER = os.getenv("AI_PROVIDER", "openai")
+VAPID_PRIVATE_KEY = os.getenv('VAPID_PRIVATE_KEY')
+VAPID_MAILTO = os.getenv('VAPID_MAILTO')
+
+# Push services speak HTTP/2; one keep-alive client per worker process reuses
+# the TLS connection to each push origin and multiplexes concurrent sends on it
+_PUSH_CLIENT = httpx.Client(
+    http2=True,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=32),
+    timeout=10.0
+)
+
+# VAPID JWTs are valid for 12 hours; sign once per push origin and reuse the
+# header until shortly before it expires
+VAPID_TOKEN_LIFETIME = 12 * 60 * 60
+_vapid_headers_cache = TTLCache(maxsize=256, ttl=VAPID_TOKEN_LIFETIME - 60 * 60)
+_vapid_headers_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=1)
+def _vapid():
+    """Parse the VAPID private key once per process"""
+    if not VAPID_PRIVATE_KEY:
+        raise WebPushException("VAPID_PRIVATE_KEY is not set")
+    if os.path.isfile(VAPID_PRIVATE_KEY):
+        return Vapid.from_file(private_key_file=VAPID_PRIVATE_KEY)
+    return Vapid.from_string(private_key=VAPID_PRIVATE_KEY)
+
+@cached(_vapid_headers_cache, lock=_vapid_headers_lock)
+def _vapid_headers(audience):
+    """Signed VAPID Authorization header for a push service origin"""
+    return _vapid().sign({
+        "sub": f"mailto:{VAPID_MAILTO}",
+        "aud": audience,
+        "exp": int(time.time()) + VAPID_TOKEN_LIFETIME
+    })
+
+def _post_push(subscription_info, data, ttl=0):
+    """Encrypt a payload (bytes) for a subscription and POST it over the shared client"""
+    endpoint = subscription_info['endpoint']
+    encoded = WebPusher(subscription_info).encode(data, content_encoding="aes128gcm")
+
+    origin = urlparse(endpoint)
+    headers = {
+        **_vapid_headers(f"{origin.scheme}://{origin.netloc}"),
+        "Content-Encoding": "aes128gcm",
+        "TTL": str(ttl)
+    }
+
+    response = _PUSH_CLIENT.post(endpoint, content=encoded['body'], headers=headers)
+    if response.status_code > 202:
+        raise WebPushException(f"Push failed: {response.status_code} {response.reason_phrase}", response=response)
+    return response
+
+# Notification body; fields are substituted as pre-encoded JSON values
+_PUSH_PAYLOAD_TEMPLATE = b'{"title":%s,"body":%s,"url":%s}'
+
+def _encode_payload(title, body, url=None):
+    """Notification JSON (bytes) without building an intermediate dict"""
+    return _PUSH_PAYLOAD_TEMPLATE % (orjson.dumps(title), orjson.dumps(body), orjson.dumps(url))
+
+# Status codes worth retrying; anything else from the push service is final
+RETRY_PUSH_STATUS_CODES = (429, 500, 502, 503, 504)
+
+@dramatiq.actor(max_retries=3, min_backoff=1000, max_backoff=30000)
+def send_push_notification(subscription_id, title, body, url=None):
+    """Send a push notification to a subscription; transient failures are retried by Dramatiq"""
+    with get_ro_db() as db:
+        subscription = db.execute(
+            select(PushSubscription.endpoint, PushSubscription.auth, PushSubscription.p256dh)
+            .where(PushSubscription.id == subscription_id, PushSubscription.is_active == 'active')
+        ).first()
+    if not subscription:
+        logger.info("No active subscription found for subscription_id: %s", subscription_id)
+        return
+
+    subscription_info = {'endpoint': subscription.endpoint, 'keys': {'auth': subscription.auth, 'p256dh': subscription.p256dh}}
+    payload = _encode_payload(title, body, url)
+    
     try:
-        logger.info(f"Attempting to send push notification to subscription: {subscription.endpoint}")
-        logger.info(f"VAPID private key available: {bool(os.getenv('VAPID_PRIVATE_KEY'))}")
-        logger.info(f"VAPID mailto available: {bool(os.getenv('VAPID_MAILTO'))}")
-        
-        vapid_private_key = os.getenv('VAPID_PRIVATE_KEY')
-        vapid_claims = {
-            "sub": f"mailto:{os.getenv('VAPID_MAILTO')}"
-        }
-        
-        payload = {
-            "title": title,
-            "body": body,
-            "url": url
-        }
-        
-        logger.info(f"Sending notification with payload: {payload}")
-        
-        webpush(
-            subscription_info=subscription.to_dict(),
-            data=json.dumps(payload),
-            vapid_private_key=vapid_private_key,
-            vapid_claims=vapid_claims
-        )
-        logger.info(f"Push notification sent successfully to {subscription.endpoint}")
-        return True
+        logger.info("Attempting to send push notification to subscription: %s", subscription.endpoint)
+        logger.debug("Sending notification with payload: %s", payload)
+        _post_push(subscription_info, payload)
+        logger.info("Push notification sent successfully to %s", subscription.endpoint)
     except WebPushException as e:
-        logger.error(f"WebPushException details: status_code={e.response.status_code if e.response else 'None'}, message={str(e)}")
-        if e.response and e.response.status_code == 410:
+        status_code = e.response.status_code if e.response is not None else None
+        logger.error(f"WebPushException details: status_code={status_code}, message={str(e)}")
+        if status_code in (404, 410):
             # Subscription has expired or is no longer valid
-            logger.info(f"Subscription {subscription.endpoint} is no longer valid")
+            logger.info("Subscription %s is no longer valid", subscription.endpoint)
             with get_db() as db:
-                subscription.is_active = 'inactive'
+                db.execute(
+                    update(PushSubscription)
+                    .where(PushSubscription.id == subscription_id)
+                    .values(is_active='inactive')
+                )
                 db.commit()
+        elif status_code in RETRY_PUSH_STATUS_CODES:
+            raise
         else:
             logger.error(f"Failed to send push notification: {str(e)}")
-        return False
+
+# Broadcast deliveries are independent; threads share _PUSH_CLIENT, so sends
+# to the same push service are multiplexed over its HTTP/2 connection
+_PUSH_POOL = ThreadPoolExecutor(max_workers=32, thread_name_prefix='push')
+
+def _deliver_push(subscription_info, data):
+    """Send one broadcast notification; returns 'sent', 'expired' or 'failed'"""
+    try:
+        _post_push(subscription_info, data)
+        return 'sent'
+    except WebPushException as e:
+        if e.response is not None and e.response.status_code in (404, 410):
+            return 'expired'
+        logger.error(f"Failed to send push notification to {subscription_info['endpoint']}: {str(e)}")
+        return 'failed'
     except Exception as e:
-        logger.error(f"Unexpected error sending push notification: {str(e)}", exc_info=True)
-        return False
+        logger.error(f"Unexpected error sending push notification to {subscription_info['endpoint']}: {str(e)}")
+        return 'failed'
+
+def _fan_out_push(subscriptions, title, body, url=None):
+    """Send one notification to many subscription_info dicts; returns (sent, expired) counts"""
+    data = _encode_payload(title, body, url)
+
+    results = list(_PUSH_POOL.map(lambda sub: _deliver_push(sub, data), subscriptions))
+
+    # Deactivate every expired endpoint in one statement
+    expired = [sub['endpoint'] for sub, result in zip(subscriptions, results) if result == 'expired']
+    if expired:
+        with get_db() as db:
+            db.execute(
+                update(PushSubscription)
+                .where(PushSubscription.endpoint.in_(expired))
+                .values(is_active='inactive')
+            )
+            db.commit()
+        invalidate_active_push_subscriptions()
+
+    return results.count('sent'), len(expired)
+
+# Subscriptions per send_push_batch message: small enough for one batch to
+# finish well inside its time limit, large enough to amortize the message
+PUSH_BATCH_SIZE = 500
+
+@dramatiq.actor(max_retries=0, time_limit=5 * 60 * 1000)  # 5 min timeout in ms
+def send_push_batch(subscriptions, title, body, url=None):
+    """Send one notification to a chunk of subscription_info dicts, concurrently"""
+    sent, expired = _fan_out_push(subscriptions, title, body, url)
+    logger.info("[Task] Push batch sent to %d/%d subscriptions, %d expired", sent, len(subscriptions), expired)
+
+@dramatiq.actor(max_retries=0)
+def broadcast_push_task(title, body, url=None):
+    """Send one notification to every active push subscription, one batch message per chunk"""
+    subscriptions = get_active_push_subscriptions()
+    # Chunks run in parallel across worker processes, each under its own time limit
+    for start in range(0, len(subscriptions), PUSH_BATCH_SIZE):
+        send_push_batch.send(list(subscriptions[start:start + PUSH_BATCH_SIZE]), title, body, url)
+    logger.info("[Task] Broadcast queued for %d subscriptions", len(subscriptions))
+
+# The site's push subscription id, or NULL unless it is still active;
+# correlated to the site row an UPDATE ... RETURNING touches
+_ACTIVE_SUBSCRIPTION_ID = (
+    select(PushSubscription.id)
+    .where(PushSubscription.id == Site.subscription_id, PushSubscription.is_active == 'active')
+    .correlate(Site)
+    .scalar_subquery()
+    .label("subscription_id")
+)
+
+@retry_conflict
+def _persist_success(db, site_id, ai_html, compressed):
+    """Save generated content; returns (app_name, subscription_id), or None if the site was already successful"""
+    try:
+        # The stored manifest is left alone; every app_name/icon_url write keeps it current
+        row = db.execute(
+            update(Site)
+            .where(Site.id == site_id, Site.status != "success")
+            .values(content=ai_html, status="success", **compressed)
+            .returning(Site.app_name, _ACTIVE_SUBSCRIPTION_ID)
+        ).first()
+        if row is None:
+            # Either already successful or never created; only the latter inserts
+            row = db.execute(
+                pg_insert(Site).values(
+                    id=site_id, content=ai_html, status="success", **compressed,
+                    manifest_json=build_site_manifest(site_id, None, None)[0]
+                ).on_conflict_do_nothing(index_elements=['id'])
+                .returning(Site.app_name, null().label("subscription_id"))
+            ).first()
+        if row:
+            notify_status(db, SITE_STATUS_CHANNEL, site_id)
+        db.commit()
+        if row:
+            logger.info("[Task] Saved site %s with status success", site_id)
+        return row
+    except Exception:
+        # Leave the session usable for a retry or the error path
+        db.rollback()
+        raise
+
+def _mark_status(db, site_id, status, title, body):
+    """Record a failed generation and let the subscriber know"""
+    # A site that was saved successfully keeps its status
+    row = db.execute(
+        update(Site)
+        .where(Site.id == site_id, Site.status != "success")
+        .values(status=status)
+        .returning(_ACTIVE_SUBSCRIPTION_ID)
+    ).first()
+    if row is None:
+        db.rollback()
+        return
+    notify_status(db, SITE_STATUS_CHANNEL, site_id)
+    db.commit()
+    # Queued after the commit so no transaction is held open during delivery
+    if row.subscription_id is not None:
+        send_push_notification.send(row.subscription_id, title, body, None)
 
 @dramatiq.actor(max_retries=0, time_limit=15 * 60 * 1000)  # 15 min timeout in ms
 def generate_site_task(site_id, prompt):
     start_time = time.time()
-    logger.info(f"[Task] Starting site generation for site_id: {site_id}")
+    logger.info("[Task] Starting site generation for site_id: %s", site_id)
     
-    try:
-        # Call AI service
-        logger.info("[Task] Calling AI service")
-        ai_start_time = time.time()
-        ai_html = call_ai_service(prompt)
-        ai_duration = time.time() - ai_start_time
-        logger.info(f"[Task] AI service completed in {ai_duration:.2f}s")
-        
-        # Inject PWA support
-        logger.info("[Task] Injecting PWA support")
-        pwa_start_time = time.time()
-        ai_html = inject_pwa_support(ai_html, site_id)
-        pwa_duration = time.time() - pwa_start_time
-        logger.info(f"[Task] PWA injected in {pwa_duration:.2f}s")
-        
-        # Save to database
-        logger.info("[Task] Saving to database")
-        max_retries = 3
-        db_retry_delay = 1  # seconds
-        
-        for attempt in range(max_retries):
-            try:
-                with get_db() as db:
-                    site = db.query(Site).filter(Site.id == site_id).first()
-                    if site:
-                        # Update site content and status if not already successful
-                        if site.status != "success":
-                            site.content = ai_html
-                            site.status = "success"
-                            db.commit()
-                            logger.info(f"[Task] Updated site {site_id} status to success")
-                        
-                        # Send notification if there's a subscription, regardless of previous status
-                        if site.subscription_id:
-                            logger.info(f"[Task] Found subscription_id: {site.subscription_id}")
-                            subscription = db.query(PushSubscription).filter(
-                                PushSubscription.id == site.subscription_id,
-                                PushSubscription.is_active == 'active'
-                            ).first()
-                            
-                            if subscription:
-                                logger.info(f"[Task] Found active subscription: {subscription.endpoint}")
-                                site_url = f"/site/{site_id}"
-                                app_name = site.app_name or "Super Cool App"
-                                notification_sent = send_push_notification(
-                                    subscription,
-                                    "Site Generation Complete! 🎉",
-                                    f"{app_name} is ready to view",
-                                    site_url
-                                )
-                                logger.info(f"[Task] Notification send attempt result: {notification_sent}")
-                            else:
-                                logger.info(f"[Task] No active subscription found for subscription_id: {site.subscription_id}")
-                        else:
-                            logger.info(f"[Task] No subscription_id found for site: {site_id}")
-                    else:
-                        site = Site(id=site_id, content=ai_html, status="success")
-                        db.add(site)
-                        db.commit()
-                        logger.info(f"[Task] Created new site {site_id}")
-                    return
-            except Exception as db_error:
-                if attempt == max_retries - 1:
-                    raise db_error
-                logger.warning(f"DB retry {attempt+1} failed: {str(db_error)}")
-                time.sleep(db_retry_delay * (attempt + 1))
-
-    except TimeoutError as e:
-        logger.error(f"[Task Timeout] {e}")
-        with get_db() as db:
-            site = db.query(Site).filter(Site.id == site_id).first()
-            if site:
-                site.status = "timeout"
-                # Send notification for timeout if there's a subscription
-                if site.subscription_id:
-                    subscription = db.query(PushSubscription).filter(
-                        PushSubscription.id == site.subscription_id,
-                        PushSubscription.is_active == 'active'
-                    ).first()
-                    if subscription:
-                        send_push_notification(
-                            subscription,
-                            "Site Generation Timeout ⏰",
-                            "Your site generation took too long. Please try again.",
-                            None
-                        )
-                db.commit()
-        raise
+    # One session for the whole task, shared by the retries and the error
+    # paths; it only checks out a connection once it touches the database
+    with get_db() as db:
+        try:
+            # Call AI service; PWA support and compression are applied as the response streams in
+            logger.info("[Task] Calling AI service")
+            ai_start_time = time.time()
+            ai_html, compressed = generate_site_html(prompt, site_id)
+            ai_duration = time.time() - ai_start_time
+            logger.info("[Task] AI service completed in %.2fs", ai_duration)
+            
+            # Save to database
+            logger.info("[Task] Saving to database")
+            saved = _persist_success(db, site_id, ai_html, compressed)
+            
+            # Send notification if the site has an active subscription;
+            # delivery runs in its own actor, outside this task's time limit
+            if saved and saved.subscription_id is not None:
+                logger.info("[Task] Queueing notification for subscription: %s", saved.subscription_id)
+                send_push_notification.send(
+                    saved.subscription_id,
+                    "Site Generation Complete! 🎉",
+                    f"{saved.app_name or 'Super Cool App'} is ready to view",
+                    f"/site/{site_id}"
+                )
 
-    except Exception as e:
-        logger.error(f"[Task Error] {e}")
-        with get_db() as db:
-            site = db.query(Site).filter(Site.id == site_id).first()
-            if site:
-                site.status = "error"
-                # Send notification for error if there's a subscription
-                if site.subscription_id:
-                    subscription = db.query(PushSubscription).filter(
-                        PushSubscription.id == site.subscription_id,
-                        PushSubscription.is_active == 'active'
-                    ).first()
-                    if subscription:
-                        send_push_notification(
-                            subscription,
-                            "Site Generation Failed ❌",
-                            "There was an error generating your site. Please try again.",
-                            None
-                        )
-                db.commit()
-        raise
+        # Dramatiq's time limit raises TimeLimitExceeded, a BaseException that
+        # "except Exception" never sees; unwinding here also closes the AI request
+        except (TimeLimitExceeded, TimeoutError) as e:
+            logger.error(f"[Task Timeout] {e!r}")
+            db.rollback()
+            _mark_status(
+                db, site_id, "timeout",
+                "Site Generation Timeout ⏰",
+                "Your site generation took too long. Please try again."
+            )
+            raise
 
-@dramatiq.actor(max_retries=0, time_limit=15 * 60 * 1000)  # 15 min timeout in ms
-def generate_css_task(css_id, prompt, css_content):
-    logger.info(f"[Task] Starting CSS generation for css_id: {css_id}")
-    try:
-        # Get the configured provider (default to OpenRouter)
-        provider_name = os.getenv("AI_PROVIDER", "openrouter")
-        provider = AIProviderFactory.get_provider(provider_name)
-        
-        logger.info(f"[Task] Using AI provider: {provider_name}")
-        
-        css_prompt = f"""
+        except Exception as e:
+            logger.error(f"[Task Error] {e}")
+            db.rollback()
+            _mark_status(
+                db, site_id, "error",
+                "Site Generation Failed ❌",
+                "There was an error generating your site. Please try again."
+            )
+            raise
+
+# Prompt for restyling a site's CSS, built once
+_CSS_PROMPT_TEMPLATE = Template("""
 I need you to act as an LEGENDARY webapp desiner. 
 There is code someone wrote that needs to be elevated.
 Friends are coming to you for your expertise and knowledge.
@@ -199,31 +317,79 @@ Here are some basic requests from your friends:
 - Optimize for performance (efficient selectors, minimal specificity)
 
 Of course, you enjoy helping your friends build and want to make the best version possible.
-Here is the idea your friend needs you to make a reality: {prompt}
-And here is the code that needs to be modified: {css_content}
-"""
+Here is the idea your friend needs you to make a reality: $prompt
+And here is the code that needs to be modified: $css_content
+""")
 
-        logger.info("[Task] Calling AI service for CSS generation")
-        new_css = provider.generate_content(css_prompt)
-        new_css = strip_code_block(new_css)
+@dramatiq.actor(max_retries=0, time_limit=15 * 60 * 1000)  # 15 min timeout in ms
+def generate_css_task(css_id, prompt, css_content):
+    logger.info("[Task] Starting CSS generation for css_id: %s", css_id)
+    # One session for the task; only used once the CSS has been generated
+    with get_db() as db:
+        try:
+            # Get the configured provider (default to OpenRouter)
+            provider = AIProviderFactory.get_provider(AI_PROVIDER)
+            
+            logger.info("[Task] Using AI provider: %s", AI_PROVIDER)
+            
+            css_prompt = _CSS_PROMPT_TEMPLATE.substitute(prompt=prompt, css_content=css_content)
 
-        logger.info("[Task] Saving to database")
-        with get_db() as db:
-            css_gen = db.query(CSSGeneration).filter(CSSGeneration.id == css_id).first()
+            logger.info("[Task] Calling AI service for CSS generation")
+            new_css = provider.generate_content(css_prompt)
+            new_css = strip_code_block(new_css)
+
+            logger.info("[Task] Saving to database")
+            css_gen = db.get(CSSGeneration, css_id)
             if css_gen:
                 css_gen.status = 'completed'
                 css_gen.css_content = new_css
+                notify_status(db, CSS_STATUS_CHANNEL, css_id)
                 db.commit()
-                logger.info(f"[Task] CSS generation completed for css_id: {css_id}")
+                logger.info("[Task] CSS generation completed for css_id: %s", css_id)
 
-        return
+            return
 
-    except Exception as e:
-        logger.error(f"[Task Error] Error in CSS generation: {str(e)}")
-        with get_db() as db:
-            css_gen = db.query(CSSGeneration).filter(CSSGeneration.id == css_id).first()
+        except (Exception, TimeLimitExceeded) as e:
+            error = "CSS generation timed out" if isinstance(e, TimeLimitExceeded) else str(e)
+            logger.error(f"[Task Error] Error in CSS generation: {error}")
+            db.rollback()
+            css_gen = db.get(CSSGeneration, css_id)
             if css_gen:
                 css_gen.status = 'error'
-                css_gen.error = str(e)
+                css_gen.error = error
+                notify_status(db, CSS_STATUS_CHANNEL, css_id)
                 db.commit()
-        raise
+            raise
+
+@dramatiq.actor(max_retries=0, time_limit=5 * 60 * 1000)  # 5 min timeout in ms
+def generate_icon_task(icon_id, prompt):
+    logger.info("[Task] Starting icon generation for icon_id: %s", icon_id)
+    # One session for the task; only used once the icon has been generated
+    with get_db() as db:
+        try:
+            # Get the configured provider (default to OpenAI)
+            provider = AIProviderFactory.get_provider(IMAGE_AI_PROVIDER)
+            
+            icon_url = provider.generate_image(prompt)
+            # Images not already on our bucket (DALL-E links expire after an
+            # hour) are re-hosted there as a 512x512 PNG
+            if not icon_url.startswith("https://pocket-vibe"):
+                icon_url = download_and_resize_image(icon_url, f"icon_{icon_id}")
+
+            icon_gen = db.get(IconGeneration, icon_id)
+            if icon_gen:
+                icon_gen.status = 'completed'
+                icon_gen.icon_url = icon_url
+                db.commit()
+                logger.info("[Task] Icon generation completed for icon_id: %s", icon_id)
+
+        except (Exception, TimeLimitExceeded) as e:
+            error = "Icon generation timed out" if isinstance(e, TimeLimitExceeded) else str(e)
+            logger.error(f"[Task Error] Error in icon generation: {error}")
+            db.rollback()
+            icon_gen = db.get(IconGeneration, icon_id)
+            if icon_gen:
+                icon_gen.status = 'error'
+                icon_gen.error = error
+                db.commit()
+            raise
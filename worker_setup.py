@@ -1,7 +1,163 @@
-import os
+import queue
+import atexit
+import logging
+import threading
 import dramatiq
 from dramatiq_pg import PostgresBroker
+from tenacity import retry, stop_after_attempt, wait_exponential, before_sleep_log
 
-DATABASE_URL = os.getenv("DATABASE_URL")
-broker = PostgresBroker(url=DATABASE_URL)
+logger = logging.getLogger(__name__)
+
+# Under dramatiq-gevent (or Gunicorn's gevent workers) sockets are patched but
+# psycopg2 is a C extension; make its waits yield to other greenlets too
+try:
+    from gevent import monkey
+    if monkey.is_module_patched("socket"):
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+except ImportError:
+    pass
+
+from db import engine
+
+class EnginePool:
+    """
+    The psycopg2 pool interface (getconn/putconn) dramatiq_pg expects, backed
+    by the SQLAlchemy engine's pool so the broker and the ORM share one set
+    of connections, limits and health checks per process
+    """
+    # dramatiq_pg walks minconn idle connections after a disconnect; the
+    # engine's pre-ping already replaces broken ones on checkout
+    minconn = 0
+
+    def __init__(self, engine):
+        self._engine = engine
+        self._checked_out = {}
+        self._lock = threading.Lock()
+
+    def getconn(self):
+        fairy = self._engine.raw_connection()
+        conn = fairy.driver_connection
+        with self._lock:
+            self._checked_out[id(conn)] = fairy
+        return conn
+
+    def putconn(self, conn, close=False):
+        with self._lock:
+            fairy = self._checked_out.pop(id(conn))
+        if close or conn.closed:
+            fairy.invalidate()
+            return
+        try:
+            # The broker switches listening connections to autocommit; put
+            # them back the way SQLAlchemy handed them out
+            if conn.autocommit:
+                with conn.cursor() as cursor:
+                    cursor.execute("UNLISTEN *")
+                conn.autocommit = False
+        except Exception:
+            fairy.invalidate()
+            return
+        fairy.close()
+
+class WarmupMiddleware(dramatiq.Middleware):
+    """Pay one-time setup costs when a worker process boots instead of on its first tasks"""
+
+    def after_worker_boot(self, broker, worker):
+        # Imported here: tasks imports this module for the broker
+        import tasks
+        from ai.factory import AIProviderFactory
+
+        steps = (
+            # Parses the VAPID key (and loads the EC backend) for push signing
+            ("VAPID key", tasks._vapid),
+            # Builds the providers and their HTTP clients for this process
+            ("AI provider", lambda: AIProviderFactory.get_provider(tasks.AI_PROVIDER)),
+            ("image AI provider", lambda: AIProviderFactory.get_provider(tasks.IMAGE_AI_PROVIDER)),
+            # Opens a pooled database connection
+            ("database connection", lambda: engine.connect().close()),
+        )
+        for name, warm in steps:
+            try:
+                warm()
+            except Exception as e:
+                # Left to fail (and be reported) on the task that needs it
+                logger.warning(f"Worker warmup of {name} failed: {str(e)}")
+
+broker = PostgresBroker(pool=EnginePool(engine))
+broker.add_middleware(WarmupMiddleware())
 dramatiq.set_broker(broker)
+
+# Messages waiting to be published by the background sender, so web requests
+# don't wait on the broker round trip; each is queued with its failure callback
+_enqueue_q = queue.Queue(maxsize=10000)
+_sender = None
+_sender_lock = threading.Lock()
+
+@retry(
+    stop=stop_after_attempt(5),
+    wait=wait_exponential(multiplier=0.5, max=8),
+    before_sleep=before_sleep_log(logger, logging.WARNING),
+    reraise=True
+)
+def _publish(message):
+    """Publish a message, backing off through broker outages"""
+    broker.enqueue(message)
+
+def _give_up(message, on_failure, error):
+    """Report a message that could not be published, so its caller isn't left waiting"""
+    logger.error(f"Failed to enqueue {message.actor_name} message {message.message_id}: {str(error)}")
+    if on_failure is None:
+        return
+    try:
+        on_failure()
+    except Exception as e:
+        logger.error(f"Failure handler for {message.actor_name} message {message.message_id} failed: {str(e)}")
+
+def _drain():
+    """Publish queued messages until the process exits"""
+    while True:
+        message, on_failure = _enqueue_q.get()
+        try:
+            _publish(message)
+        except Exception as e:
+            _give_up(message, on_failure, e)
+        finally:
+            _enqueue_q.task_done()
+
+def _flush():
+    """Publish anything still queued at shutdown"""
+    while True:
+        try:
+            message, on_failure = _enqueue_q.get_nowait()
+        except queue.Empty:
+            return
+        # One attempt each, so a broker outage doesn't stall shutdown
+        try:
+            broker.enqueue(message)
+        except Exception as e:
+            _give_up(message, on_failure, e)
+
+atexit.register(_flush)
+
+def enqueue(actor, *args, on_failure=None, **kwargs):
+    """
+    Queue an actor message for publishing in the background.
+    Publishing is retried; if it still fails, on_failure() is called so the
+    caller can record the failure. Falls back to a synchronous send (which
+    raises on failure) if the local queue is full.
+    """
+    global _sender
+    message = actor.message(*args, **kwargs)
+    # Started lazily so it runs in the serving process, not a pre-fork parent
+    if _sender is None or not _sender.is_alive():
+        with _sender_lock:
+            if _sender is None or not _sender.is_alive():
+                _sender = threading.Thread(target=_drain, name="dramatiq-enqueue", daemon=True)
+                _sender.start()
+    try:
+        _enqueue_q.put_nowait((message, on_failure))
+    except queue.Full:
+        logger.warning("Enqueue queue full, sending synchronously")
+        broker.enqueue(message)
+    return message